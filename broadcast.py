@@ -0,0 +1,254 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Render once, watch from many terminals. A BroadcastServer takes a rendered
+FrameBuffer per tick and streams it to every connected client over TCP or a
+Unix socket. A client is a plain terminal stream, e.g.
+
+    nc localhost 7070          socat - UNIX-CONNECT:/tmp/dash.sock
+
+Each client keeps its own diff state: the whole screen on connect, changed
+rows afterwards. A client may send "256\\n" for 256 color escapes instead of
+truecolor. Rows are encoded once per color depth and frame, however many
+clients there are.
+
+A client whose unsent output piles up skips frames, and catches up with a
+diff against the last frame it was sent once it drains. One stuck for
+longer than drop_after seconds is disconnected. Nobody else waits for it.
+
+    server = BroadcastServer(("localhost", 7070))
+    while True:
+        server.publish(canvas.frame_buffer())
+        server.pump(0.1)
+"""
+
+import os
+import time
+import errno
+import select
+import socket
+
+CLEAR_SCREEN = '\x1b[2J'
+CURSOR_SEQ = '\x1b[{row};1H'
+
+DEPTH_REQUESTS = {"256": 8, "truecolor": 24}
+
+
+class Client:
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.depth = 24
+
+        # last frame queued to this client, None before the first one
+        self.last = None
+        self.pending = b""
+        self.stalled_since = None
+        self.received = b""
+
+        self.frames = 0
+        self.skipped = 0
+
+
+class BroadcastServer:
+
+    def __init__(self, address, max_pending=1 << 16, drop_after=5.):
+        """
+        address:     (host, port) for TCP, or a path for a Unix socket. Port
+                     0 picks a free port, see self.address.
+        max_pending: bytes a client may have unsent before it skips frames
+        drop_after:  seconds a client may stay over max_pending
+        """
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+
+        self.max_pending = max_pending
+        self.drop_after = drop_after
+        self.clients = []
+
+        self.frame = None
+        self.previous = None
+        self.shared_changed = None
+        self.encoded = {}
+
+    ### frames
+
+    def encode(self, row, depth):
+        """
+        cursor move and escape sequences of a row of current frame, encoded
+        once per color depth.
+        """
+        key = (row, depth)
+        if key not in self.encoded:
+            text = CURSOR_SEQ.format(row=row + 1) + self.frame.encode_row(row, depth)
+            self.encoded[key] = text.encode('utf-8')
+        return self.encoded[key]
+
+    def changed_rows(self, client):
+        if client.last is None or (client.last.rows, client.last.cols) != (self.frame.rows, self.frame.cols):
+            return None
+
+        # clients keeping up share the diff against the previous frame
+        if client.last is self.previous:
+            if self.shared_changed is None:
+                self.shared_changed = self.frame.changed_rows(self.previous)
+            return self.shared_changed
+        return self.frame.changed_rows(client.last)
+
+    def publish(self, fb):
+        """
+        queue a new frame to every client not lagging behind
+        """
+        self.previous, self.frame = self.frame, fb
+        self.shared_changed = None
+        self.encoded = {}
+
+        now = time.time()
+        for client in list(self.clients):
+            if len(client.pending) > self.max_pending:
+                client.skipped += 1
+                if client.stalled_since is None:
+                    client.stalled_since = now
+                elif now - client.stalled_since > self.drop_after:
+                    self.drop(client)
+                continue
+            client.stalled_since = None
+
+            rows = self.changed_rows(client)
+            if rows is None:
+                data = [CLEAR_SCREEN] + [self.encode(row, client.depth) for row in range(fb.rows)]
+            else:
+                data = [self.encode(row, client.depth) for row in rows]
+            client.pending += b"".join(data)
+            client.last = fb
+            client.frames += 1
+
+        self.pump(0)
+
+    ### sockets
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(False)
+            client = Client(sock, address)
+            self.clients.append(client)
+
+            # a new client gets the whole current frame
+            if self.frame is not None:
+                client.pending = CLEAR_SCREEN + b"".join(
+                    self.encode(row, client.depth) for row in range(self.frame.rows))
+                client.last = self.frame
+
+    def drop(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+            client.sock.close()
+
+    def receive(self, client):
+        try:
+            data = client.sock.recv(1024)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        if not data:
+            self.drop(client)
+            return
+
+        client.received += data
+        while b"\n" in client.received:
+            line, client.received = client.received.split(b"\n", 1)
+            depth = DEPTH_REQUESTS.get(line.strip())
+            if depth is not None and depth != client.depth:
+                # repaint in the new encoding
+                client.depth = depth
+                client.last = None
+
+    def send(self, client):
+        try:
+            sent = client.sock.send(client.pending)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.drop(client)
+            return
+        client.pending = client.pending[sent:]
+
+    def pump(self, timeout):
+        """
+        accept clients, read their requests and send pending output, waiting
+        at most timeout seconds for sockets to become ready.
+        """
+        readers = [self.listener] + [c.sock for c in self.clients]
+        writers = [c.sock for c in self.clients if c.pending]
+        readable, writable, _ = select.select(readers, writers, [], timeout)
+
+        by_sock = dict((c.sock, c) for c in self.clients)
+        for sock in readable:
+            if sock is self.listener:
+                self.accept()
+            elif sock in by_sock:
+                self.receive(by_sock[sock])
+        for sock in writable:
+            client = by_sock.get(sock)
+            if client in self.clients:
+                self.send(client)
+
+    def serve(self, build, fps=5):
+        """
+        publish build() (a canvas) fps times a second, forever
+        """
+        while True:
+            start = time.time()
+            self.publish(build().frame_buffer())
+            while True:
+                left = start + 1. / fps - time.time()
+                if left <= 0:
+                    break
+                self.pump(left)
+
+    def close(self):
+        for client in list(self.clients):
+            self.drop(client)
+        self.listener.close()
+        if isinstance(self.address, str):
+            os.remove(self.address)
+
+
+if __name__ == "__main__":
+
+    import sys
+    import numpy as np
+
+    from congram import Canvas, CharColor, color_func
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7070
+
+    def build():
+        canvas = Canvas(cols=100)
+        canvas.add_text("dashboard %s" % time.strftime("%H:%M:%S"), CharColor((200, 200, 200)))
+        canvas.add_heatmap(np.random.random_sample((6, 10)).tolist(), color_func["Sandy"])
+        return canvas
+
+    server = BroadcastServer(("localhost", port))
+    print "serving on %s:%d, watch with: nc localhost %d" % (server.address + (port,))
+    try:
+        server.serve(build)
+    finally:
+        server.close()
@@ -3,9 +3,19 @@
 import os
 import sys
 import time
+import bisect
 import itertools
 import numpy as np
 
+from raster import line_raster, bin2d, coo_arrays, bin_sparse, block_edges, gradient_cells, HALF_BLOCK
+from framebuffer import FrameBuffer
+from palette import Palette
+from normalize import Norm
+from profiler import profiler, profiled
+from render import write, render_lines, TerminalBackend, FrameBufferBackend
+from textwidth import text_width, col_slice, rjust
+from scales import LinearScale, CategoricalScale, VERT_TICK_SPACING, place_labels
+
 def flatten(l):
     return list(itertools.chain.from_iterable(l))
 
@@ -13,9 +23,15 @@ def group_by(lis, key):
     groups = itertools.groupby(sorted(lis, key=key), key)
     return [list(dat) for _, dat in groups]
 
+# 没有终端时（比如无头渲染）使用的大小
+# size used without a terminal, e.g. when rendering headless
+DEFAULT_TERM_SIZE = (24, 80)
+
 def get_term_size():
-    rows, columns = os.popen('stty size', 'r').read().split()
-    return int(rows), int(columns)
+    size = os.popen('stty size 2>/dev/null', 'r').read().split()
+    if len(size) != 2:
+        return DEFAULT_TERM_SIZE
+    return int(size[0]), int(size[1])
 
 color_func = {
     "BlueGreenYellow" : lambda (x):Color(
@@ -35,8 +51,30 @@ color_func = {
     )
 }
 
+# 颜色按COLOR_LEVELS级量化，同一级的颜色只计算一次并共享同一个对象
+# colors are quantized into COLOR_LEVELS levels, each computed once and shared
+COLOR_LEVELS = 256
+level_colors = {}
+
+def level_color(color_func, level):
+    try:
+        return level_colors[color_func, level]
+    except KeyError:
+        color = color_func(level / float(COLOR_LEVELS-1))
+        level_colors[color_func, level] = color
+        return color
+
 def ranged_color(color_func, val, minval, maxval):
-    return color_func((val-minval)/(maxval-minval))
+    level = int(round((val-minval)/float(maxval-minval) * (COLOR_LEVELS-1)))
+    return level_color(color_func, level)
+
+def ranged_levels(vals, minval, maxval):
+    """
+    color levels of an array of values. minval and maxval may be arrays
+    broadcasting against vals, e.g. one range per panel.
+    """
+    span = np.where(maxval > minval, maxval - minval, 1.)
+    return np.rint((vals - minval) / span * (COLOR_LEVELS-1)).astype(int)
 
 
 class Pos:
@@ -99,6 +137,16 @@ class Color:
         else:
             raise TypeError("operand type must be either 3-tuple or int")
 
+    def __eq__(self, other):
+        return isinstance(other, Color) and \
+               (self.r, self.g, self.b) == (other.r, other.g, other.b)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.r, self.g, self.b))
+
     def __str__(self):
         return "{%d, %d, %d}" % (self.r, self.g, self.b)
 
@@ -145,6 +193,16 @@ class CharColor:
         else:
             raise TypeError("operand type must be tuple")
 
+    def __eq__(self, other):
+        return self is other or isinstance(other, CharColor) and \
+               self.fore == other.fore and self.back == other.back
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.fore, self.back))
+
     def __str__(self):
         return str(self.fore) + " " + str(self.back)
 
@@ -162,71 +220,223 @@ class Rect:
 
 
 
+# layout caches shared by all canvases are dropped as a whole when they hold
+# this many entries, e.g. when live ranges keep producing new keys.
+MAX_CACHED_LAYOUTS = 256
+
+
 class Canvas:
 
 
     rows, cols = get_term_size()
 
-    # graphic elements hold by Canvas.
-    elems = []
+    # rendered legends shared by all canvases, see legend_layout()
+    legend_cache = {}
+
+    # rows of frames shared by all canvases, see frame_template()
+    frame_cache = {}
+
+    # file rendered to, sys.stdout if None. E.g. a pacing.Pacer.
+    out = None
+
+    def __init__(self, cols=None):
+        """
+        cols: width of canvas, the terminal width by default
+        """
+        if cols is not None:
+            self.cols = cols
+
+        # graphic elements hold by Canvas, bucketed by row. Each bucket is a
+        # list of (col, z, elem) kept sorted by column, where z is the order
+        # of insertion and decides which element is on top.
+        self.lines = {}
+        self.elem_count = 0
+
+        # colors of elements are kept as ids into the palette
+        self.palette = Palette()
+
+        # rows changed since last render, and rows already on the screen in
+        # order, empty rows are skipped. Used by update() for partial redrawing.
+        self.dirty_rows = set()
+        self.rendered_rows = []
+
+        # translucent layers blended over the elements, see add_overlay()
+        self.overlays = []
 
-    # for successively adding elements
-    current_line = 0
+        # for successively adding elements
+        self.current_line = 0
 
+    def add_elem(self, elem, z=None):
+        """
+        添加一个元素，按列有序地插入其所在行。
+        insert an element into the bucket of its row, keeping column order.
+        """
+        if z is None:
+            z = self.elem_count
+            self.elem_count += 1
+
+        elem.color = self.palette.intern(elem.color)
+
+        line = self.lines.setdefault(elem.pos.row, [])
+        bisect.insort(line, (elem.pos.col, z, elem))
+        self.dirty_rows.add(elem.pos.row)
+        return elem
+
+    def find_elem(self, elem):
+        line = self.lines.get(elem.pos.row, [])
+        i = bisect.bisect_left(line, (elem.pos.col,))
+        while i < len(line) and line[i][0] == elem.pos.col:
+            if line[i][2] is elem:
+                return i
+            i += 1
+        raise ValueError("element is not on canvas")
+
+    def remove_elem(self, elem):
+        line = self.lines[elem.pos.row]
+        _, z, _ = line.pop(self.find_elem(elem))
+        if line == []:
+            del self.lines[elem.pos.row]
+        self.dirty_rows.add(elem.pos.row)
+        return z
+
+    def replace_elem(self, elem, new_elem):
+        """
+        replace an element with a new one, which stays at the same depth.
+        """
+        self.add_elem(new_elem, self.remove_elem(elem))
+        return new_elem
+
+    @profiled("build")
     def add_text(self, text, color, anchor=None):
 
         if anchor is None:
-            anchor = Pos(self.current_line, (self.cols - len(text)) / 2)
+            anchor = Pos(self.current_line, (self.cols - text_width(text)) / 2)
 
         color = color * (2,1)
         self.add_empty_line(anchor)
-        self.elems.append(Rect(anchor, color, text))
+        self.add_elem(Rect(anchor, color, text))
 
         self.current_line += 2
 
     def add_empty_line(self, pos):
-        self.elems.append(Rect(Pos(pos.row, 0), CharColor(), " "*self.cols))
+        self.add_elem(Rect(Pos(pos.row, 0), CharColor(), " "*self.cols))
 
 
+    @profiled("build")
     def add_frame(self, size, anchor,
                   sides=("left", "right", "top", "bottom"),
                   frame_margin = Pos(3, 5),
-                  x_tick_range=None,
-                  y_tick_range=None,
+                  x_scale=None,
+                  y_scale=None,
                   rep=None,
                   x_off=None,
                   y_off=None):
+        """
+        x_scale, y_scale: 坐标轴刻度（scales.py），给出时按刻度画tick并标上数字，
+                          否则按rep和x_off/y_off等间隔画tick
+        """
         color = CharColor((255, 255, 255))
 
         # 四面边框和中间内容距离之和，比如如果左边距为1，上边距为2，则以下边距
         # 应该为(1*2+1, 2*2+1) = (3, 5)，考虑到等宽字体的宽高比例，这个比例是刚
         # 刚好的.
 
+        content_size = size
+        margin = frame_margin.center()
         size = size + frame_margin
+
+        # tick positions relative to anchor, from scales if given
+        x_ticks = y_ticks = []
+        if y_scale is not None:
+            y_ticks = y_scale.ticks(content_size.row, VERT_TICK_SPACING, True)
+            y_ticks = [(margin.row + off, label) for off, label in y_ticks]
+        if x_scale is not None:
+            x_ticks = x_scale.ticks(content_size.col)
+            x_ticks = [(margin.col + off, label) for off, label in x_ticks]
+        if y_scale is not None:
+            y_tick_rows = [off for off, _ in y_ticks]
+        elif x_off is not None and rep.col is not None:
+            y_tick_rows = [l for l in range(size.row+1) if (l + x_off) % rep.col == 0]
+        else:
+            y_tick_rows = []
+        if x_scale is not None:
+            x_tick_cols = [off for off, _ in x_ticks]
+        elif y_off is not None and rep.row is not None:
+            x_tick_cols = [l for l in range(1, size.col) if (l + y_off) % rep.row == 0]
+        else:
+            x_tick_cols = []
+
+        # 每行边框是一整个元素，从行首铺满整个画布宽度
+        # each row of the frame is a single element, spanning the whole width
+        # of canvas like an empty line.
+        left_pad = u" " * anchor.col
+        right_pad = u" " * max(self.cols - anchor.col - size.col - 1, 0)
+        for l, row in enumerate(self.frame_template(size, tuple(sides),
+                                                    tuple(y_tick_rows), tuple(x_tick_cols))):
+            self.add_elem(Rect(Pos(anchor.row + l, 0), color, left_pad + row + right_pad))
+
+        # 坐标轴数字：下方一行，左侧右对齐
+        # tick labels, one line below the bottom axis, and right aligned on the
+        # left of left axis.
+        if x_ticks:
+            label_row = anchor + Pos(size.row + 1, 0)
+            self.add_empty_line(label_row)
+            for col, label in place_labels(x_ticks, size.col + 1):
+                self.add_elem(Rect(label_row + Pos(0, col), color, label))
+        if y_ticks:
+            width = max(text_width(label) for _, label in y_ticks)
+            left = max(anchor.col - width - 1, 0)
+            for row, label in y_ticks:
+                pos = Pos(anchor.row + row, left)
+                self.add_elem(Rect(pos, color, rjust(label, width)))
+
+        return size + Pos(1 if x_ticks else 0, 0)
+
+    def clear_labels(self, anchor, y_scale, rows):
+        """
+        anchor moved right if needed, so that the y-axis labels of y_scale
+        fit on the left of the frame
+        """
+        ticks = y_scale.ticks(rows, VERT_TICK_SPACING, True)
+        width = max([text_width(label) for _, label in ticks] + [0])
+        return Pos(anchor.row, max(anchor.col, width + 1))
+
+    def frame_template(self, size, sides, y_tick_rows, x_tick_cols):
+        """
+        rows of a frame of given size as whole strings, cached so that each
+        kind of frame is built only once.
+        """
+
+        key = (size.row, size.col, sides, y_tick_rows, x_tick_cols)
+        if key in Canvas.frame_cache:
+            return Canvas.frame_cache[key]
+
+        rows = [[u" "] * (size.col + 1) for _ in range(size.row + 1)]
+        y_tick_rows = set(y_tick_rows)
         for l in range(size.row+1):
-            self.add_empty_line(Pos(l, 0) + anchor)
-            tick_char =  u"│"
-            if x_off is not None and rep.col is not None:
-                if (l + x_off) % rep.col == 0:
-                    tick_char = u"├"
             if "left" in sides:
-                self.elems.append(Rect(Pos(l, 0)+anchor, color, tick_char))
+                rows[l][0] = u"├" if l in y_tick_rows else u"│"
             if "right" in sides:
-                self.elems.append(Rect(Pos(l, size.col)+anchor, color, u"│"))
-
-        for l in range(1,size.col):
-            tick_char =  u"─"
-            if y_off is not None and rep.row is not None:
-                if (l + y_off) % rep.row == 0:
-                    tick_char = u"┴"
-            if "top" in sides:
-                self.elems.append(Rect(Pos(0, l)+anchor, color, u"─"))
-            if "bottom" in sides:
-                self.elems.append(Rect(Pos(size.row, l)+anchor, color, tick_char))
+                rows[l][size.col] = u"│"
+
+        if "top" in sides:
+            rows[0][1:size.col] = [u"─"] * (size.col - 1)
+        if "bottom" in sides:
+            rows[size.row][1:size.col] = [u"─"] * (size.col - 1)
+            for l in x_tick_cols:
+                if 0 < l < size.col:
+                    rows[size.row][l] = u"┴"
 
         for corner, char in zip(size.corners(), [u"┌", u"└", u"┘", u"┐"]):
-            self.elems.append(Rect(anchor+corner, color, char))
+            rows[corner.row][corner.col] = char
 
+        template = [u"".join(row) for row in rows]
+        if len(Canvas.frame_cache) >= MAX_CACHED_LAYOUTS:
+            Canvas.frame_cache.clear()
+        Canvas.frame_cache[key] = template
+        return template
+
+    @profiled("build")
     def add_cell(self, cell, size, color, anchor):
 
         """
@@ -236,15 +446,16 @@ class Canvas:
         color:  单元格颜色
         anchor: 锚点
         """
-        cell = cell.rjust(size.col)
+        cell = rjust(cell, size.col)
 
         # 在若干行连续画长度为size.col的小色块，在中间那行写字
         for l in range(size.row):
-            string = cell if l == size.row//2 else "".rjust(len(cell))
-            self.elems.append(Rect(anchor + Pos(l, 0), color, string))
+            string = cell if l == size.row//2 else " " * text_width(cell)
+            self.add_elem(Rect(anchor + Pos(l, 0), color, string))
 
         return size
 
+    @profiled("build")
     def add_grid(self, table, cell_size, color_func, anchor=None):
 
         for [row_num, row] in enumerate(table):
@@ -254,30 +465,47 @@ class Canvas:
 
         return cell_size * Pos(row_num, col_num)
 
+    @profiled("build")
     def add_heatmap(self, table, color_func,
                     thermo=False,
                     draw_frame=False,
-                    anchor=None):
+                    anchor=None,
+                    row_labels=None,
+                    col_labels=None,
+                    norm=None,
+                    vrange=None):
+        """
+        norm:   normalize.Norm mapping values to colors, min/max by default
+        vrange: (lo, hi) the colors span, e.g. from a QuantileSketch of live
+                data. Found from table by norm if not given.
+        """
 
         table_size = size(table)
-        flat       = flatten(table)
-        min_cell   = min(flat)
-        max_cell   = max(flat)
+        if norm is None:
+            norm = Norm()
+        if vrange is None:
+            vrange = norm.value_range(table)
+        min_cell, max_cell = vrange
+        levels = np.rint(norm(table, vrange) * (COLOR_LEVELS-1)).astype(int)
 
 
         # 生成一个新的带颜色的表格，顺便获得最长单元格字符串的长度,
-        # generate colored table along with the max length of string
+        # 每个色阶的颜色只在调色板里登记一次
+        # generate colored table along with the max length of string. Colors
+        # are interned into the palette once per level, cells keep the id.
         colored_table = []
         cell_len      = 0
+        level_ids     = {}
 
-        for lis in table:
+        for lis, level_row in zip(table, levels.tolist()):
             colored_table.append([])
 
-            for cell in lis:
+            for cell, level in zip(lis, level_row):
                 cell_str   = " %1.2f " % cell
-                cell_bc    = ranged_color(color_func, cell, min_cell, max_cell)
-                cell_color = CharColor(cell_bc+127, cell_bc)
-                colored_table[-1].append((cell_str, cell_color))
+                if level not in level_ids:
+                    cell_bc = level_color(color_func, level)
+                    level_ids[level] = self.palette.intern(CharColor(cell_bc+127, cell_bc))
+                colored_table[-1].append((cell_str, level_ids[level]))
 
                 if cell_len < len(cell_str):
                     cell_len = len(cell_str)
@@ -293,138 +521,396 @@ class Canvas:
             actual_left = (self.cols - len(table[0]) * cell_len) / 2
             anchor = Pos(self.current_line, actual_left)
 
+        if row_labels is None:
+            row_labels = range(table_size.row)
+        if col_labels is None:
+            col_labels = range(table_size.col)
+        y_scale = CategoricalScale(row_labels)
+
+        # 左侧留出行标签的宽度，表格比画布宽时也不会越过左边
+        # leave room for the row labels on the left, also when the table is
+        # wider than canvas
+        anchor = self.clear_labels(anchor, y_scale, table_size.row * cell_size.row)
 
         # 画边框，并决定单元格的起始位置
         # Draw the frame, and also decide where cells starts
         # if draw_frame is True:
         frame_size = self.add_frame(table_size * cell_size, anchor,
                     frame_margin=frame_margin,
-                    rep=cell_size.t(), x_off=0, y_off=0)
+                    x_scale=CategoricalScale(col_labels),
+                    y_scale=y_scale)
         cell_anchor = anchor + frame_margin.center()
         # 画单元格
         # draw each cell
         self.add_grid(colored_table, cell_size, color_func, cell_anchor)
 
+        # 在右侧加上温度计
+        # Add a thermometer on the right side
+        if thermo:
+            self.add_legend(color_func, (min_cell, max_cell),
+                            table_size.row * cell_size.row,
+                            cell_anchor + Pos(0, frame_size.col))
+
+        self.current_line = max(self.current_line, anchor.row + frame_size.row + 1)
         return frame_size
 
-        # Add a thermometer on the right side
-#        thermo_left = len(table[0]) * cell_size.col + 10
-#        for line in range(1, len(table) * 3 + 6):
-#            pos = Pos(line, thermo_left) + anchor
-#            back = color_func(1.0 - 1.0 * line / (len(table) * 3+3))
-#            color = CharColor(Color(0, 0, 0), back)
-#            self.elems.append(Rect(pos, color, "    "))
-#
-#        self.current_line += len(table)*3 + 4
-
-    def add_hist(self, hist, color_func, anchor=None):
-
-        max_val = max(hist[0])
-        height  = 30
-        bar_width = 5
+    @profiled("build")
+    def add_sparse_heatmap(self, matrix, color_func, cells=(12, 16),
+                           reduce="sum", **kwargs):
+        """
+        稀疏矩阵的热力图，非零元素直接聚合到cells个格子里，不生成稠密矩阵
+        matrix: scipy.sparse矩阵，COO元组(row, col, data, shape)，或者
+                CSR字典{indptr, indices, data, shape}
+        cells:  最多(行数, 列数)个格子，每个格子汇总矩阵的一块
+        reduce: "sum", "mean", "max"或"count"
+        其余参数同add_heatmap，行列标签默认为每块的起始下标
+        """
+        row, col, data, shape = coo_arrays(matrix)
+        grid = bin_sparse(row, col, data, shape, cells, reduce)
+
+        kwargs.setdefault("row_labels", block_edges(shape[0], grid.shape[0])[:-1].tolist())
+        kwargs.setdefault("col_labels", block_edges(shape[1], grid.shape[1])[:-1].tolist())
+        return self.add_heatmap(grid.tolist(), color_func, **kwargs)
+
+    @profiled("build")
+    def add_small_multiples(self, tables, color_func,
+                            titles=None,
+                            shared_scale=True,
+                            cell_width=6,
+                            gap=2,
+                            thermo=False,
+                            anchor=None):
+        """
+        小多图：把多个同样大小的矩阵并排画成一组面板，排不下时自动换行
+        tables:       N个形状相同的二维矩阵，或者一个N×rows×cols的数组
+        titles:       面板标题，默认为序号
+        shared_scale: 所有面板共用一个颜色范围，否则每个面板各自归一化
+        cell_width:   单元格宽度，不小于5时在单元格里写数值
+        thermo:       共用颜色范围时在下方加一个图例
+        """
+
+        stack = np.asarray(tables, dtype=float)
+        num, rows, cols = stack.shape
+        if titles is None:
+            titles = range(num)
+
+        # 所有面板的颜色一次算出
+        # color levels of all panels computed in one pass
+        if shared_scale:
+            lo, hi = stack.min(), stack.max()
+        else:
+            lo = stack.min(axis=(1, 2), keepdims=True)
+            hi = stack.max(axis=(1, 2), keepdims=True)
+        levels = ranged_levels(stack, lo, hi)
+
+        if cell_width >= 5:
+            texts = np.char.center(np.char.mod("%1.2f", stack), cell_width)
+        else:
+            texts = np.empty(stack.shape, dtype='S%d' % cell_width)
+            texts[:] = " " * cell_width
+        changes = levels[:, :, 1:] != levels[:, :, :-1]
+
+        # 面板的几何尺寸和边框只算一次，所有面板共用
+        # geometry and border of a panel are computed once for all panels
+        panel = Pos(rows + 2, cols * cell_width + 2)
+        per_row = max(1, min(num, (self.cols + gap) // (panel.col + gap)))
+        panel_rows = (num + per_row - 1) // per_row
+        block = Pos(panel_rows * panel.row, per_row * (panel.col + gap) - gap)
+
+        border = [(Pos(0, 0), u"┌" + u"─" * (panel.col - 2) + u"┐"),
+                  (Pos(panel.row - 1, 0), u"└" + u"─" * (panel.col - 2) + u"┘")]
+        for r in range(1, panel.row - 1):
+            border.append((Pos(r, 0), u"│"))
+            border.append((Pos(r, panel.col - 1), u"│"))
+
+        if anchor is None:
+            anchor = Pos(self.current_line, max(self.cols - block.col, 0) // 2)
+        for l in range(block.row):
+            self.add_empty_line(anchor + Pos(l, 0))
+
+        frame_color = CharColor((255, 255, 255))
+        cell_colors = {}
+        for i in range(num):
+            origin = anchor + Pos(i // per_row, i % per_row) * (panel + Pos(0, gap))
+            for offset, text in border:
+                self.add_elem(Rect(origin + offset, frame_color, text))
+
+            title = u" %s " % titles[i]
+            if text_width(title) > panel.col - 4:
+                title = col_slice(title, 0, panel.col - 4)
+            self.add_elem(Rect(origin + Pos(0, 2), frame_color, title))
+
+            # 每行按颜色相同的相邻单元格合并成一个元素
+            # each row of a panel adds one element per run of equal colors
+            for r in range(rows):
+                bounds = [0] + (np.flatnonzero(changes[i, r]) + 1).tolist() + [cols]
+                for left, right in zip(bounds[:-1], bounds[1:]):
+                    level = int(levels[i, r, left])
+                    if level not in cell_colors:
+                        cell_bc = level_color(color_func, level)
+                        cell_colors[level] = CharColor(cell_bc+127, cell_bc)
+                    pos = origin + Pos(1 + r, 1 + left * cell_width)
+                    self.add_elem(Rect(pos, cell_colors[level], "".join(texts[i, r, left:right])))
+
+        if thermo and shared_scale:
+            self.add_legend(color_func, (lo, hi), block.col,
+                            anchor + Pos(block.row, 0), vertical=False)
+            block = block + Pos(3, 0)
+
+        self.current_line = max(self.current_line, anchor.row + block.row + 1)
+        return block
+
+    def legend_layout(self, color_func, vrange, length, vertical, thickness):
+        """
+        returns [(offset, text, color)] of a legend, cached so that the same
+        legend is only computed once.
+        """
+
+        key = (color_func, tuple(vrange), length, vertical, thickness)
+        if key in Canvas.legend_cache:
+            return Canvas.legend_cache[key]
+
+        first, second = gradient_cells(length)
+        labels = ("%.3g" % vrange[0], "%.3g" % vrange[1])
+        label_color = CharColor((255, 255, 255))
+        layout = []
+
+        # 半块字符的前景色和背景色分别画一个格子的两半，精度加倍
+        # each cell draws two colors with a half block, by its fore and back
+        # color. Vertical legends have the max on top.
+        if vertical:
+            for l in range(length):
+                color = CharColor(color_func(1 - first[l]), color_func(1 - second[l]))
+                layout.append((Pos(l, 0), HALF_BLOCK[True] * thickness, color))
+            layout.append((Pos(0, thickness + 1), labels[1], label_color))
+            layout.append((Pos(length - 1, thickness + 1), labels[0], label_color))
+        else:
+            for l in range(length):
+                color = CharColor(color_func(first[l]), color_func(second[l]))
+                for r in range(thickness):
+                    layout.append((Pos(r, l), HALF_BLOCK[False], color))
+            layout.append((Pos(thickness, 0), labels[0], label_color))
+            layout.append((Pos(thickness, length - len(labels[1])), labels[1], label_color))
+
+        if len(Canvas.legend_cache) >= MAX_CACHED_LAYOUTS:
+            Canvas.legend_cache.clear()
+        Canvas.legend_cache[key] = layout
+        return layout
+
+    @profiled("build")
+    def add_legend(self, color_func, vrange, length, anchor=None,
+                   vertical=True, thickness=2):
+        """
+        添加颜色图例
+        vrange: (min, max)，标在图例两端
+        length: 图例的长度（竖直时为行数，水平时为列数）
+        """
+
         if anchor is None:
-            anchor = Pos(self.current_line, (self.cols - len(hist[0]) * bar_width) / 2)
+            width = thickness if vertical else length
+            anchor = Pos(self.current_line, (self.cols - width) // 2)
+
+        layout = self.legend_layout(color_func, vrange, length, vertical, thickness)
+        for offset, text, color in layout:
+            self.add_elem(Rect(anchor + offset, color, text))
+
+        height = length if vertical else thickness + 1
+        self.current_line = max(self.current_line, anchor.row + height + 1)
 
-        self.add_frame(Pos(height + 3, len(hist[0])*bar_width + 5), anchor,
-                       x_rep=3, x_off=0, y_rep=bar_width, y_off=0)
+    @profiled("build")
+    def add_hist(self, hist, color_func, anchor=None, height=30, bar_width=5):
+        """
+        hist: (counts, bin_edges)，即np.histogram的返回值
+        """
 
-        hist_anchor = anchor + Pos(2, 3)
+        counts, edges = hist[0], hist[1]
+        max_val = float(max(counts))
+        frame_margin = Pos(3, 5)
+        if anchor is None:
+            anchor = Pos(self.current_line, (self.cols - len(counts) * bar_width) / 2)
+        y_scale = LinearScale(0, max_val)
+        anchor = self.clear_labels(anchor, y_scale, height)
+
+        frame_size = self.add_frame(Pos(height, len(counts) * bar_width), anchor,
+                                    frame_margin=frame_margin,
+                                    x_scale=LinearScale(edges[0], edges[-1]),
+                                    y_scale=y_scale)
+
+        hist_anchor = anchor + frame_margin.center()
         for line in range(height):
-            for ith, val in enumerate(hist[0]):
+            for ith, val in enumerate(counts):
                 pos  = Pos(line, ith*bar_width) + hist_anchor
-                if height * (1 - val/max_val) < line:
+                if height * (1 - val/max_val) < line + 1:
                     color = color_func(val/max_val)
-                    self.elems.append(Rect(pos, CharColor(color, color*2), "    "))
+                    self.add_elem(Rect(pos, CharColor(color, color*2), " " * (bar_width - 1)))
 
-        self.current_line += 30
+        self.current_line = max(self.current_line, anchor.row + frame_size.row + 1)
+        return frame_size
 
-    def render_line(self, elems_inline, is_reset=False):
+    @profiled("build")
+    def add_line(self, data, color, height=8, width=None,
+                 style="braille", vrange=None, anchor=None):
         """
-        render elements in single line
+        添加折线图
+        data:   一维数组，任意长度，会被降采样到width列
+        style:  "braille"（点阵折线）或者"block"（柱状）
+        vrange: (min, max)，默认为数据的范围
         """
 
-        # Find all elements to be rendered in current line
-        # elems_inline = [elem for elem in self.elems if elem.pos.row == line_num]
-
-        visible_parts = []
+        if width is None:
+            width = self.cols // 2
 
-        def visible_check((A_left, A_right, _), (B_left, B_right, B_id)):
+        if anchor is None:
+            anchor = Pos(self.current_line, (self.cols - width) // 2)
 
-            # compare the left/right bound of new element with each
-            # existing bound.
+        lines = line_raster[style](data, width, height, vrange)
+        for l, text in enumerate(lines):
+            self.add_empty_line(anchor + Pos(l, 0))
+            self.add_elem(Rect(anchor + Pos(l, 0), color, text))
 
-            A_left_shaded  = A_left  <= B_left
-            A_right_shaded = A_right >= B_right
-            A_left_dodged  = A_right <  B_left
-            A_right_dodged = A_left  >  B_right
+        self.current_line = max(self.current_line, anchor.row + height + 1)
 
-            # Four cases of shading:
-            # 1. dodged: the fore and back element doesn't overlap
-            # 2. shaded: fore element shaded at left or right bound of back
-            #            element.
-            # 3. split:  fore element splits back element into two visible
-            #            parts.
+    def add_sparkline(self, data, color, width=None, anchor=None):
+        self.add_line(data, color, 1, width, "block", anchor=anchor)
 
-            if A_left_dodged or A_right_dodged: # dodged
-                return ((B_left, B_right, B_id),)
-            elif not (A_left_shaded or A_right_shaded): # splitted
-                return ((B_left,  A_left,  B_id),(A_right, B_right, B_id))
-            elif (A_left_shaded and A_right_shaded): # fully shaded
-                return []
-            else: # partially shaded
-                if A_left_shaded:
-                    return ((A_right, B_right, B_id),)
-                if A_right_shaded:
-                    return ((B_left, A_left, B_id),)
+    @profiled("build")
+    def add_scatter(self, x, y, color_func, size=Pos(20, 60),
+                    xrange=None, yrange=None, log_scale=True, anchor=None):
+        """
+        添加散点密度图，点先被统计到每个单元格里，绘制开销与点数无关。
+        x, y:      坐标数组
+        size:      图的行数和列数
+        log_scale: 按log(1+count)着色，避免密集区域掩盖稀疏区域
+        """
 
-        for elem_i, elem in enumerate(elems_inline):
+        if anchor is None:
+            anchor = Pos(self.current_line, (self.cols - size.col) // 2)
 
-            elem_bound = (elem.pos.col, elem.pos.col + len(elem.text), elem_i)
+        counts  = bin2d(x, y, (size.row, size.col), xrange, yrange)
+        density = np.log1p(counts) if log_scale else counts
+        maxval  = max(density.max(), 1)
 
-            for i, part in enumerate(visible_parts):
-                visible_parts[i] = visible_check(elem_bound, part)
-            visible_parts.append((elem_bound,))
+        for l in range(size.row):
+            self.add_empty_line(anchor + Pos(l, 0))
+        for row, col in zip(*np.nonzero(density)):
+            back = ranged_color(color_func, density[row, col], 0., maxval)
+            pos  = anchor + Pos(int(row), int(col))
+            self.add_elem(Rect(pos, CharColor(back, back), " "))
 
-            # list flatten operation by itertools.chain flatten both list and
-            # tuple (and all iterables), thus we have to coat it with one more
-            # tuple in order to maintain the form.
-            visible_parts = flatten(visible_parts)
+        self.current_line = max(self.current_line, anchor.row + size.row + 1)
 
-        visible_parts = sorted(visible_parts, key=lambda x:x[0])
+    def add_overlay(self, pos, size, rgb, alpha=0.5, planes=("fg", "bg")):
+        """
+        translucent layer over whatever is on the canvas at pos, e.g. a
+        highlight or a selection. alpha is an opacity, or an array of
+        opacities of size (rows, cols) for a mask. Overlays are blended on
+        the color planes of frame_buffer(), a whole region at once.
+        """
+        self.overlays.append((pos, size, rgb, alpha, planes))
+        self.dirty_rows.update(range(pos.row, pos.row + size.row))
 
-        # handles if no elements in this line
-        strokes = "" if visible_parts == [] else " " * visible_parts[0][0]
+    def overlay_rows(self):
+        rows = set()
+        for pos, size, _, _, _ in self.overlays:
+            rows.update(range(pos.row, pos.row + size.row))
+        return rows
 
-        COLOR_RESET = '\x01\x1b[0m\x02'
+    def backend(self, is_reset=False):
+        return TerminalBackend(self.palette, self.out, is_reset)
 
-        for part in visible_parts:
-            elem = elems_inline[part[2]]
-            color = elem.color
-            text = elem.text[part[0] - elem.pos.col : part[1] - elem.pos.col]
-            strokes += self.stroke(text, color)
-            strokes += COLOR_RESET if is_reset else ""
+    def shown_rows(self, blended=()):
+        """
+        rows put on the screen, those holding elements or under an overlay
+        """
+        return sorted(set(row for row, elems in self.lines.items() if elems) | set(blended))
 
-        sys.stdout.write(strokes + COLOR_RESET)
-        sys.stdout.write("\n")
+    def render_row(self, line_num, backend, fb=None, blended=()):
+        """
+        render a line, taken from fb (the frame buffer with overlays
+        blended) if it is one of the blended rows.
+        """
+        if line_num in blended and line_num < fb.rows:
+            write(fb.encode_row(line_num, self.palette.depth) + u"\n", self.out)
+        else:
+            render_lines([(line_num, self.lines.get(line_num, []))], backend)
 
     def render(self, is_reset=False):
-        sys.stdout.flush()
-        sys.stdout.write("\n")
-
-        render_lines = group_by(self.elems, lambda elem: elem.pos.row)
-
-        for line_elems in render_lines:
-            self.render_line(line_elems, is_reset)
+        out = self.out or sys.stdout
+        out.flush()
+        out.write("\n")
+
+        fb = self.frame_buffer() if self.overlays else None
+        blended = self.overlay_rows()
+        backend = self.backend(is_reset)
+        # 空行不输出
+        # empty rows are skipped
+        self.rendered_rows = self.shown_rows(blended)
+        for line_num in self.rendered_rows:
+            self.render_row(line_num, backend, fb, blended)
+
+        self.dirty_rows.clear()
+        profiler.count("lines", len(self.rendered_rows))
+        profiler.count("elements", sum(len(l) for l in self.lines.values()))
+        profiler.end_frame()
+
+    def frame_buffer(self):
+        """
+        composite the canvas into a FrameBuffer instead of the terminal.
+        """
+        rows = max(self.lines) + 1 if self.lines else 0
+        fb = FrameBuffer(rows, self.cols)
+        render_lines(sorted(self.lines.items()), FrameBufferBackend(fb, self.palette))
 
-    def stroke(self, text, c):
+        for pos, size, rgb, alpha, planes in self.overlays:
+            fb.blend(rgb, alpha, (pos.row, pos.col, pos.row + size.row, pos.col + size.col), planes)
+        return fb
 
-        COLOR_FORE = 38
-        COLOR_BACK = 48
+    def update(self, is_reset=False):
+        """
+        re-render only the lines changed since last render. The cursor is
+        expected to stay right below the rendered canvas. A row filled in
+        between rows on the screen cannot be inserted in place, the whole
+        canvas is rendered again below then.
+        """
 
-        color_seq = '\x01\x1b[{z};2;{r};{g};{b}m\x02'
-        fore = color_seq.format(z=COLOR_FORE, r=c.fore.r, g=c.fore.g, b=c.fore.b)
-        back = color_seq.format(z=COLOR_BACK, r=c.back.r, g=c.back.g, b=c.back.b)
-        return fore+back+text
+        CURSOR_UP   = '\x1b[{n}A\r'
+        CURSOR_DOWN = '\x1b[{n}B\r'
+        ERASE_LINE  = '\x1b[2K'
+
+        blended = self.overlay_rows()
+        shown = self.rendered_rows
+        last = shown[-1] if shown else -1
+        new_rows = set(self.shown_rows(blended)) - set(shown)
+        if any(row < last for row in new_rows):
+            self.render(is_reset)
+            return
+
+        fb = self.frame_buffer() if self.overlays else None
+        backend = self.backend(is_reset)
+        for line_num in sorted(self.dirty_rows):
+
+            # lines below the rendered area are simply appended, empty ones
+            # skipped as in render()
+            if line_num > last:
+                if line_num in new_rows:
+                    self.render_row(line_num, backend, fb, blended)
+                    shown.append(line_num)
+                continue
+
+            # rendered lines end with a newline, thus we come back one line less
+            i = bisect.bisect_left(shown, line_num)
+            if i == len(shown) or shown[i] != line_num:
+                continue
+            offset = len(shown) - i
+            write(CURSOR_UP.format(n=offset) + ERASE_LINE, self.out)
+            self.render_row(line_num, backend, fb, blended)
+            if offset > 1:
+                write(CURSOR_DOWN.format(n=offset - 1), self.out)
+
+        profiler.count("lines", len(self.dirty_rows))
+        self.dirty_rows.clear()
+        backend.flush()
+        profiler.end_frame()
 
 
 if __name__ == "__main__":
@@ -7,6 +7,16 @@ import time
 
 import numpy as np
 
+from raster import line_raster, bin2d, coo_arrays, bin_sparse, block_edges, gradient_cells, HALF_BLOCK
+from framebuffer import FrameBuffer
+from palette import Palette
+from normalize import Norm
+from pipeline import Pipeline
+from profiler import profiler, profiled
+from render import write, render_lines, TerminalBackend, FrameBufferBackend
+from textwidth import text_width, col_slice, rjust, ljust, center
+from scales import CategoricalScale, VERT_TICK_SPACING, place_labels
+
 def flatten(l):
     if l == []:
         return []
@@ -19,6 +29,88 @@ def group_by(lis, key):
     groups = itertools.groupby(sorted(lis, key=key), key)
     return [list(dat) for _, dat in groups]
 
+# 没有终端时（比如无头渲染）使用的大小
+# size used without a terminal, e.g. when rendering headless
+DEFAULT_TERM_SIZE = (24, 80)
+
+def get_term_size():
+    size = os.popen('stty size 2>/dev/null', 'r').read().split()
+    if len(size) != 2:
+        return DEFAULT_TERM_SIZE
+    return int(size[0]), int(size[1])
+
+def uncovered_spans(row, left, right, boxes):
+    """
+    parts of columns [left, right) in given row not covered by any of boxes.
+    A box is (top, left, bottom, right), with bottom and right exclusive.
+    """
+    spans = [(left, right)]
+    for box_top, box_left, box_bottom, box_right in boxes:
+        if not box_top <= row < box_bottom:
+            continue
+
+        remained = []
+        for l, r in spans:
+            if box_right <= l or box_left >= r:
+                remained.append((l, r))
+                continue
+            if l < box_left:
+                remained.append((l, box_left))
+            if box_right < r:
+                remained.append((box_right, r))
+
+        spans = remained
+        if spans == []:
+            break
+    return spans
+
+def box_covered(box, boxes):
+    top, left, bottom, right = box
+    for b_top, b_left, b_bottom, b_right in boxes:
+        if b_top <= top and b_left <= left and b_bottom >= bottom and b_right >= right:
+            return True
+    return all(uncovered_spans(row, left, right, boxes) == []
+               for row in range(top, bottom))
+
+# 遮挡盒子按行和列块分桶
+# cover boxes are bucketed by row and by blocks of this many columns
+BUCKET_COLS = 16
+
+class BoxIndex:
+    """
+    boxes bucketed by row and block of columns, so that boxes over a box are
+    found without going through all of them. Each box is added with an
+    order, e.g. the index of the child it covers for, and searches can skip
+    boxes of lower order.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, boxes, order):
+        for box in boxes:
+            top, left, bottom, right = box
+            for row in range(top, bottom):
+                for block in range(left // BUCKET_COLS, (right - 1) // BUCKET_COLS + 1):
+                    self.buckets.setdefault((row, block), []).append((order, box))
+
+    def over(self, box, order=0):
+        """
+        boxes of at least given order intersecting box
+        """
+        top, left, bottom, right = box
+        found = set()
+        for row in range(top, bottom):
+            for block in range(left // BUCKET_COLS, (right - 1) // BUCKET_COLS + 1):
+                for o, b in self.buckets.get((row, block), ()):
+                    if o >= order and b[1] < right and left < b[3]:
+                        found.add(b)
+        return list(found)
+
+    def covers(self, box, order=0):
+        boxes = self.over(box, order)
+        return bool(boxes) and box_covered(box, boxes)
+
 
 color_func = {
     "BlueGreenYellow" : lambda (x):Color(
@@ -38,10 +130,32 @@ color_func = {
     )
 }
 
+# 颜色按COLOR_LEVELS级量化，同一级的颜色只计算一次并共享同一个对象
+# colors are quantized into COLOR_LEVELS levels, each computed once and shared
+COLOR_LEVELS = 256
+level_colors = {}
+
+# stroke caches shared by all rects are dropped as a whole when they hold
+# this many entries, e.g. when live ranges keep producing new keys.
+MAX_CACHED_LAYOUTS = 256
+
+def level_color(color_scheme_name, level):
+    try:
+        return level_colors[color_scheme_name, level]
+    except KeyError:
+        color = color_func[color_scheme_name](level / float(COLOR_LEVELS-1))
+        level_colors[color_scheme_name, level] = FullColor(color + 127, color)
+        return level_colors[color_scheme_name, level]
+
 def full_color(color_scheme_name, val, minval, maxval):
-    normed_val = (val-minval)/(maxval-minval)
-    color = color_func[color_scheme_name](normed_val)
-    return FullColor(color + 127, color)
+    level = int(round((val-minval)/float(maxval-minval) * (COLOR_LEVELS-1)))
+    return level_color(color_scheme_name, level)
+
+def scheme_colors(color_scheme_name):
+    """
+    level_color of every level, indexed by level
+    """
+    return [level_color(color_scheme_name, level) for level in range(COLOR_LEVELS)]
 
 
 def ranged_color(color_func, val, minval, maxval):
@@ -106,6 +220,16 @@ class Color:
         else:
             raise TypeError("operand type must be either 3-tuple or int")
 
+    def __eq__(self, other):
+        return isinstance(other, Color) and \
+               (self.r, self.g, self.b) == (other.r, other.g, other.b)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.r, self.g, self.b))
+
     def __str__(self):
         return "{%d, %d, %d}" % (self.r, self.g, self.b)
 
@@ -153,6 +277,16 @@ class FullColor:
         else:
             raise TypeError("operand type must be tuple")
 
+    def __eq__(self, other):
+        return self is other or isinstance(other, FullColor) and \
+               self.fore == other.fore and self.back == other.back
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.fore, self.back))
+
     def __str__(self):
         return str(self.fore) + " " + str(self.back)
 
@@ -163,44 +297,9 @@ class Stroke:
         self.color = color
         self.text = text
 
-    def trunc(self, num, is_from_left=True):
-
-        # 当从左边trunc时，text删去开头的num个字符，同时pos向右推进num个字符
-        # ；当从右边trunc时，只需要去掉text末尾的num个字符，不需要改起始位置
-
-        if is_from_left:
-            trunced = len(self.text) - num
-            return Stroke(self.pos + Pos(0, trunced), self.text[trunced:], self.color)
-        else:
-            return Stroke(self.pos, self.text[:num], self.color)
-
-    def shaded_by(self, next):
-
-        # 讨论next（另一个Stroke）对自己遮挡的情况，先获取两个对象的左右
-        # 边界。首先考虑互不遮挡的情况，即next右边界在self左边界的左边，或者next
-        # 左边界在self右边界的右边。若不是这种情况，则当next左边界在self左边界右边
-
-        self_l = self.pos.col
-        self_r = self.pos.col + len(self.text)
-        next_l = next.pos.col
-        next_r = next.pos.col + len(next.text)
-
-        l_shaded = next_l <= self_l
-        r_shaded = next_r >= self_r
-        dodged   = self.pos.row != next.pos.row or next_r < self_l or next_l > self_r
-
-        if dodged: # dodged
-            return [self]
-        elif l_shaded and r_shaded:
-            return []
-        elif not (l_shaded or r_shaded):
-            return [self.trunc(next_l - self_l, is_from_left=False),
-                    self.trunc(self_r - next_r, is_from_left=True)]
-        else:
-            if l_shaded:
-                return [self.trunc(self_r - next_r, is_from_left=True)]
-            if r_shaded:
-                return [self.trunc(next_l - self_l, is_from_left=False)]
+    def box(self):
+        return (self.pos.row, self.pos.col,
+                self.pos.row + 1, self.pos.col + text_width(self.text))
 
     def __str__(self):
 
@@ -221,6 +320,20 @@ class Rect:
     render_time = 0
     render_count = 0
 
+    # an opaque rect paints every cell of its box, thus hides whatever is
+    # drawn before under it.
+    opaque = True
+
+    # below 1 the rect and its children are a translucent layer, blended
+    # on top of the rest of the tree, see compose().
+    opacity = 1.
+
+    # palette of the rect being drawn, created on first draw
+    palette = None
+
+    # file drawn to, sys.stdout if None. E.g. a pacing.Pacer.
+    out = None
+
     def __init__(self,
                  pos=Pos(0, 0),
                  size=Pos(10, 20),
@@ -242,53 +355,182 @@ class Rect:
         child_bottom_right.shallower_than(self_bottom_right):
             self.children.append(child)
 
+    def box(self, pos):
+        top_left = self.pos + pos
+        bottom_right = top_left + self.size
+        return (top_left.row, top_left.col, bottom_right.row, bottom_right.col)
+
+    def cover_boxes(self, pos):
+        """
+        boxes fully painted by this rect and its children, at given offset.
+        """
+        if self.opaque:
+            return [self.box(pos)]
+        return flatten([child.covers(self.pos + pos) for child in self.children])
+
+    def covers(self, pos):
+        # a translucent rect hides nothing
+        if self.opacity < 1:
+            return []
+        return self.cover_boxes(pos)
+
     ### Override this for more effective rendering
-    def render_rect(self, pos):
+    def render_rect(self, pos, covered=()):
 
         strokes = []
 
-        # 以下是当前Rect生成的Stroke.
+        # 以下是当前Rect生成的Stroke. 被遮挡的空白部分不生成
+        # strokes of this rect. Blank parts covered by later rects are skipped.
         for line in range(self.size.row):
-            if line == int(round(self.size.row*0.5)) - 1:
-                stroke_text = self.text.center(self.size.col, " ")
-            else:
-                stroke_text = "".ljust(self.size.col, " ")
             stroke_pos = self.pos + pos + Pos(line, 0)
-            strokes.append(Stroke(stroke_pos, stroke_text, self.color))
+            if line == int(round(self.size.row*0.5)) - 1:
+                stroke_text = center(self.text, self.size.col)
+                strokes.append(Stroke(stroke_pos, stroke_text, self.color))
+                continue
+
+            spans = uncovered_spans(stroke_pos.row, stroke_pos.col,
+                                    stroke_pos.col + self.size.col, covered)
+            for left, right in spans:
+                span_pos = Pos(stroke_pos.row, left)
+                strokes.append(Stroke(span_pos, " " * (right - left), self.color))
 
         return strokes
 
-    def render(self, pos):
+    def render(self, pos, covered=(), layers=None):
+        """
+        covered: boxes painted by rects drawn after this one. Strokes and
+                 children hidden under them are not generated at all.
+        layers:  if a list, translucent children are not rendered but
+                 appended to it as (child, pos)
+        """
+
+        abs_pos = self.pos + pos
+        box = self.box(pos)
+        if covered and box_covered(box, covered):
+            profiler.count("culled")
+            return []
 
-        strokes = self.render_rect(pos)
+        # boxes covering for the rect are of order of the children, the boxes
+        # given from above come after all of them. A child is covered by
+        # boxes of later order only, each looked up once in the index.
+        index = BoxIndex()
+        index.add(covered, len(self.children))
+        for i, child in enumerate(self.children):
+            index.add(child.covers(abs_pos), i)
+        own_covered = index.over(box)
+
+        if profiler.enabled:
+            profiler.enter()
+            start = time.time()
+            strokes = self.render_rect(pos, own_covered)
+            elapsed = time.time() - start
+            profiler.leave("build", elapsed)
+
+            # render_time and render_count are kept per node type
+            node_type = self.__class__
+            node_type.render_time += elapsed
+            node_type.render_count += 1
+            profiler.add_node(node_type.__name__, elapsed, len(strokes))
+        else:
+            strokes = self.render_rect(pos, own_covered)
+
+        if own_covered:
+            strokes = [rs for rs in strokes if not index.covers(rs.box())]
 
-        for child in self.children:
-            strokes.extend(child.render(self.pos + pos))
+        for i, child in enumerate(self.children):
+            if layers is not None and child.opacity < 1:
+                layers.append((child, abs_pos))
+                continue
+            later = index.over(child.box(abs_pos), i + 1)
+            strokes.extend(child.render(abs_pos, later, layers))
 
         return strokes
 
+    def render_strokes(self, layers=None):
+        """
+        strokes of the rect and all its children, with colors interned into
+        the palette.
+        """
+        if self.palette is None:
+            self.palette = Palette()
+        return self.intern(self.render(Pos(0, 0), layers=layers))
+
+    def intern(self, strokes):
+        for rs in strokes:
+            rs.color = self.palette.intern(rs.color)
+        return strokes
+
+    def stroke_lines(self, strokes):
+        """
+        strokes bucketed by row for render.render_lines, later strokes on top
+        """
+        rows = {}
+        for z, rs in enumerate(strokes):
+            rows.setdefault(rs.pos.row, []).append((rs.pos.col, z, rs))
+        return [(row, sorted(rows[row])) for row in sorted(rows)]
+
+    def put_strokes(self, fb, strokes):
+        render_lines(self.stroke_lines(strokes), FrameBufferBackend(fb, self.palette))
+
+    @profiled("blend")
+    def compose(self, strokes, layers):
+        """
+        FrameBuffer of strokes, with translucent layers blended over in
+        order. Each layer is composited into a buffer of its own and blended
+        on the color planes at once. Translucent rects inside a layer are
+        drawn opaque within it.
+        """
+        fb = FrameBuffer(self.pos.row + self.size.row, self.pos.col + self.size.col)
+        self.put_strokes(fb, strokes)
+        for node, pos in layers:
+            layer = FrameBuffer(fb.rows, fb.cols)
+            self.put_strokes(layer, self.intern(node.render(pos)))
+            fb.overlay(layer, node.opacity)
+        return fb
+
+    def frame_buffer(self):
+        """
+        composite the rect and its children into a FrameBuffer instead of the
+        terminal.
+        """
+        layers = []
+        return self.compose(self.render_strokes(layers), layers)
+
     def draw(self):
 
-        strokes = self.render(Pos(0, 0))
-        strokes = group_by(strokes, lambda rs:rs.pos.row)
+        layers = []
+        strokes = self.render_strokes(layers)
+        profiler.count("strokes", len(strokes))
 
-        for line in strokes:
-            curr_line = [line[0]]
-            for next_stroke in line[1:]:
-                curr_line = flatten([curr.shaded_by(next_stroke) for curr in curr_line])
-                curr_line.append(next_stroke)
+        # 有半透明的层时混合到FrameBuffer上再输出
+        # with translucent layers, lines come from the blended frame buffer
+        if layers:
+            fb = self.compose(strokes, layers)
+            for row in range(fb.rows):
+                write(fb.encode_row(row, self.palette.depth) + u"\n", self.out)
+            (self.out or sys.stdout).flush()
+            profiler.count("lines", fb.rows)
+            profiler.end_frame()
+            return
 
-            for rs in sorted(curr_line, key=lambda rs:rs.pos.col):
-                sys.stdout.write(unicode(rs))
-            sys.stdout.write('\n')
-            sys.stdout.flush()
+        lines = self.stroke_lines(strokes)
+        backend = TerminalBackend(self.palette, self.out)
+        render_lines(lines, backend)
+        backend.flush()
+
+        profiler.count("lines", len(lines))
+        profiler.end_frame()
 
 
 class Canvas(Rect):
 
-    def __init__(self):
-        rows, cols = os.popen('stty size', 'r').read().split()
-        size = Pos(int(rows)-1, int(cols))
+    def __init__(self, size=None):
+        """
+        size: Pos(rows, cols), fits the terminal by default
+        """
+        if size is None:
+            rows, cols = get_term_size()
+            size = Pos(rows-1, cols)
         color = FullColor()
 
         Rect.__init__(self, Pos(0, 0), size, "", color)
@@ -297,29 +539,91 @@ class Canvas(Rect):
 
 
 class Grid(Rect):
-
+    """
+    Table of equally sized cells. Labels and colors are kept as arrays and the
+    cells are not Rects of their own: each row of the table is turned into
+    runs of adjacent cells sharing a color once, and rendering emits one
+    stroke per run for each terminal line.
+    """
+
+    @profiled("build")
     def __init__(self,
                  pos=Pos(0, 0),
                  table=[[]],
                  grid_size=Pos(3, 3),
-                 back_color = FullColor((255, 255, 255), (127, 127, 127))):
+                 back_color = FullColor((255, 255, 255), (127, 127, 127)),
+                 labels=None,
+                 colors=None):
+        """
+        table:  rows of (text, color) cells, or
+        labels: 2d array of cell texts and colors: 2d object array of their
+                colors instead.
+        """
+        if labels is None:
+            labels = [[cell for cell, _ in line] for line in table]
+            colors = [[color for _, color in line] for line in table]
+
+        self.labels = np.array(labels, dtype=np.unicode_).reshape(len(labels), -1)
+        self.colors = np.empty(self.labels.shape, dtype=object)
+        self.colors[:] = colors
+
+        # 只有包含宽字符的标签才需要逐字计算宽度
+        # only distinct labels are measured
+        uniq = np.unique(self.labels)
+        max_cell_size = max([text_width(label) for label in uniq] or [0])
+        self.grid_size = Pos(grid_size.row, max_cell_size + 2)
+
+        table_size = Pos(*self.labels.shape) * self.grid_size
 
-        max_cell_size = 0
-        for line in table:
-            for cell, _ in line:
-                if max_cell_size < len(cell):
-                    max_cell_size = len(cell)
-        grid_width = max_cell_size + 2 if max_cell_size + 2 > grid_size.col else grid_size.col
-        grid_size = Pos(grid_size.row, max_cell_size + 2)
+        Rect.__init__(self, Pos(0, 0), table_size, "", back_color)
+        self.set_cells(self.labels, self.colors)
+
+    def set_cells(self, labels, colors):
+        """
+        replace labels and colors of the cells. The table keeps its size,
+        labels wider than a cell are cut.
+        """
+        self.labels = np.asarray(labels, dtype=np.unicode_)
+        self.colors = np.asarray(colors, dtype=object)
+
+        width = self.grid_size.col
+        centered = np.char.center(self.labels, width).astype('<U%d' % width)
+        for label in np.unique(self.labels):
+            if text_width(label) != len(label):
+                centered[self.labels == label] = col_slice(center(label, width), 0, width)
+
+        self.row_runs = [self.cell_runs(centered[row], self.colors[row])
+                         for row in range(self.labels.shape[0])]
+
+    def cell_runs(self, texts, colors):
+        """
+        runs of adjacent cells of the same color in a row, as
+        [(col, label text, blank text, color)].
+        """
+        if len(colors) == 0:
+            return []
 
-        table_size = Pos(len(table), len(table[0])) * grid_size
+        width = self.grid_size.col
+        change = np.flatnonzero(colors[1:] != colors[:-1]) + 1
+        bounds = [0] + change.tolist() + [len(colors)]
 
-        Rect.__init__(self, Pos(0, 0), table_size, "", back_color)
+        return [(l * width, u"".join(texts[l:r]), u" " * ((r - l) * width), colors[l])
+                for l, r in zip(bounds[:-1], bounds[1:])]
+
+    def render_rect(self, pos, covered=()):
+
+        origin = self.pos + pos
+        height = self.grid_size.row
+        label_line = int(round(height*0.5)) - 1
 
-        for row, line in enumerate(table):
-            for col, (cell, color) in enumerate(line):
-                cell_pos = grid_size * Pos(row, col)
-                self.add_child(Rect(cell_pos, grid_size, cell, color))
+        strokes = []
+        for row, runs in enumerate(self.row_runs):
+            for line in range(height):
+                line_pos = origin + Pos(row * height + line, 0)
+                for col, label, blank, color in runs:
+                    text = label if line == label_line else blank
+                    strokes.append(Stroke(line_pos + Pos(0, col), text, color))
+        return strokes
 
 
 class Heatmap(Grid):
@@ -329,19 +633,430 @@ class Heatmap(Grid):
                  table=[[]],
                  grid_size=Pos(3, 3),
                  color_scheme="Sandy",
-                 back_color = FullColor()):
+                 back_color = FullColor(),
+                 row_labels=None,
+                 col_labels=None,
+                 source=None,
+                 norm=None,
+                 vrange=None,
+                 transforms=()):
+        """
+        source:     a shared.SharedSource the values are read from instead of
+                    table. It is polled on each render, and the cells are
+                    updated whenever its producer has published new values.
+        norm:       normalize.Norm mapping values to colors, min/max by default
+        vrange:     fixed (lo, hi) the colors span, e.g. from a QuantileSketch.
+                    Found from the values on each update if None.
+        transforms: pipeline.Pipeline steps applied to the values before they
+                    are colored and labeled, e.g. ("clip", 0., 100.), ("log",)
+                    or ("aggregate", (20, 40), "max")
+        """
+
+        self.color_scheme = color_scheme
+        self.source = source
+        self.norm = Norm() if norm is None else norm
+        self.vrange = vrange
+        self.transforms = list(transforms)
+        self.pipeline = None
+        if source is not None:
+            table = source.poll(force=True)
+
+        labels, colors = self.format_values(np.asarray(table, dtype=float))
+        Grid.__init__(self, Pos(0, 0), grid_size=grid_size,
+                      labels=labels, colors=colors)
+
+        # scales for labeling rows and columns when put in a Frame
+        if row_labels is None:
+            row_labels = range(labels.shape[0])
+        if col_labels is None:
+            col_labels = range(labels.shape[1])
+        self.y_scale = CategoricalScale(row_labels)
+        self.x_scale = CategoricalScale(col_labels)
+
+    def format_values(self, values):
+        """
+        labels and colors of values, run through the pipeline of this
+        heatmap. Its buffers are reused by later updates of the same shape,
+        and it is rebuilt only when norm or vrange have been replaced.
+        """
+        if self.pipeline is None or self.pipeline_args != (self.norm, self.vrange):
+            self.pipeline_args = (self.norm, self.vrange)
+            self.pipeline = Pipeline(self.transforms + [
+                ("normalize", self.norm, self.vrange),
+                ("colorize", scheme_colors(self.color_scheme)),
+                ("format", "%1.2f")])
+
+        pipe = self.pipeline(values)
+        return pipe.labels, pipe.colors
+
+    def set_values(self, values):
+        self.set_cells(*self.format_values(np.asarray(values, dtype=float)))
+
+    def render_rect(self, pos, covered=()):
+        if self.source is not None:
+            values = self.source.poll()
+            if values is not None:
+                self.set_values(values)
+        return Grid.render_rect(self, pos, covered)
+
+class SparseHeatmap(Heatmap):
+    """
+    Heatmap of a sparse matrix. Nonzeros are aggregated straight into at most
+    cells = (rows, cols) cells, each covering a block of the matrix, so the
+    matrix is never made dense.
+    """
+
+    def __init__(self,
+                 pos=Pos(0, 0),
+                 matrix=([], [], [], (1, 1)),
+                 cells=(12, 16),
+                 reduce="sum",
+                 **kwargs):
+        """
+        matrix: a scipy.sparse matrix, a COO tuple (row, col, data, shape) or
+                a CSR dict with indptr, indices, data and shape
+        reduce: "sum", "mean", "max" or "count", see raster.bin_sparse
+        other arguments are those of Heatmap. Rows and columns are labeled
+        with the first index of their blocks by default.
+        """
+        row, col, data, shape = coo_arrays(matrix)
+        grid = bin_sparse(row, col, data, shape, cells, reduce)
+
+        kwargs.setdefault("row_labels", block_edges(shape[0], grid.shape[0])[:-1].tolist())
+        kwargs.setdefault("col_labels", block_edges(shape[1], grid.shape[1])[:-1].tolist())
+        Heatmap.__init__(self, pos, grid, **kwargs)
+
+
+class Scatter(Rect):
+    """
+    Density plot of (x, y) points. Points are binned once into the cells of
+    the rect, so rendering costs the same no matter how many points there are.
+    """
+
+    def __init__(self,
+                 pos=Pos(0, 0),
+                 x=(),
+                 y=(),
+                 size=Pos(20, 60),
+                 xrange=None,
+                 yrange=None,
+                 color_scheme="Sandy",
+                 log_scale=True,
+                 back_color=FullColor()):
+
+        Rect.__init__(self, pos, size, "", back_color)
+
+        self.xrange = xrange
+        self.yrange = yrange
+        self.color_scheme = color_scheme
+        self.log_scale = log_scale
+        self.set_data(x, y)
+
+    def set_data(self, x, y):
+        self.counts = bin2d(x, y, (self.size.row, self.size.col),
+                            self.xrange, self.yrange)
+
+    def render_rect(self, pos, covered=()):
 
-        minval = min([min(l) for l in table])
-        maxval = max([max(l) for l in table])
+        density = np.log1p(self.counts) if self.log_scale else self.counts
+        maxval  = max(density.max(), 1)
 
-        def table_item(cell, min_val, max_val, color_scheme):
-            return ("%1.2f" % c, full_color(color_scheme, c, minval, maxval))
+        strokes = Rect.render_rect(self, pos, covered)
+        for row, col in zip(*np.nonzero(density)):
+            color = full_color(self.color_scheme, density[row, col], 0., maxval)
+            stroke_pos = self.pos + pos + Pos(int(row), int(col))
+            strokes.append(Stroke(stroke_pos, " ", FullColor(color.back, color.back)))
+
+        return strokes
+
+
+def table_columns(columns):
+    """
+    [(name, 1d array)] of columnar data: a list of (name, array) pairs, a
+    dict (columns sorted by name), a structured array or a 2d array.
+    """
+    if isinstance(columns, np.ndarray):
+        if columns.dtype.names is not None:
+            return [(name, columns[name]) for name in columns.dtype.names]
+        columns = columns.reshape(len(columns), -1)
+        return [(str(i), columns[:, i]) for i in range(columns.shape[1])]
+    if isinstance(columns, dict):
+        columns = sorted(columns.items())
+    return [(name, np.asarray(values)) for name, values in columns]
+
+
+# code points below are neither wide nor combining
+WIDE_OR_COMBINING = 0x300
+
+
+def max_str_len(values):
+    """
+    length of the longest string in a fixed width string array. Strings are
+    padded with NULs up to the width of dtype, which usually is the length of
+    the longest one, so character columns are checked from the right.
+    """
+    if len(values) == 0:
+        return 0
+    chars = np.ascontiguousarray(values)
+    chars = chars.view(np.uint32 if chars.dtype.kind == 'U' else np.uint8)
+    chars = chars.reshape(len(values), -1)
+    for length in range(chars.shape[1], 0, -1):
+        if chars[:, length-1].any():
+            return length
+    return 0
+
+
+def column_width(values, fmt):
+    """
+    widest formatted value of a column, in display columns. Numbers are
+    formatted at their extremes only, strings are measured as a whole array.
+    """
+    if len(values) == 0:
+        return 0
+    kind = values.dtype.kind
+    if kind == 'U':
+        # 含宽字符或组合字符的字符串按显示宽度计算，相同的只算一次
+        # strings holding wide or combining characters are measured by
+        # display width, each distinct one once.
+        chars = np.ascontiguousarray(values).view(np.uint32).reshape(len(values), -1)
+        special = chars.max(axis=1) >= WIDE_OR_COMBINING
+        if special.any():
+            widths = [text_width(text) for text in set(values[special].tolist())]
+            return max(widths + [max_str_len(values[~special])])
+    if kind in 'SU':
+        return max_str_len(values)
+    if kind == 'b':
+        return len("False")
+    if kind == 'f':
+        finite = values[np.isfinite(values)] if not np.isfinite(values).all() else values
+        widths = [len("nan")] if len(finite) < len(values) else []
+        if len(finite):
+            widths += [len(fmt % finite.min()), len(fmt % finite.max())]
+        return max(widths)
+    return max(len(fmt % values.min()), len(fmt % values.max()))
+
+
+class Table(Rect):
+    """
+    Virtualized table of columnar data. Column widths are computed once from
+    whole columns with vectorized ops, while only the rows in view are
+    formatted on render, so a table of millions of rows opens and scrolls as
+    fast as a small one.
+    """
+
+    # default formats by dtype kind
+    formats = {'f': "%.2f", 'i': "%d", 'u': "%d", 'b': "%s", 'S': "%s", 'U': "%s"}
+
+    def __init__(self,
+                 pos=Pos(0, 0),
+                 columns=(),
+                 size=Pos(20, 80),
+                 formats=None,
+                 max_width=24,
+                 show_index=True,
+                 color=FullColor((220, 220, 220), (20, 20, 20)),
+                 stripe_color=FullColor((220, 220, 220), (35, 35, 40)),
+                 header_color=FullColor((20, 20, 20), (180, 180, 180))):
+        """
+        columns:   list of (name, array), dict of arrays, structured array or
+                   2d array, all columns of the same length
+        size:      rows (including the header line) and columns on screen
+        formats:   {column name: printf format}, by dtype otherwise
+        max_width: columns wider than this are cut
+        """
+
+        Rect.__init__(self, pos, size, "", color)
+
+        self.columns = []
+        for name, values in table_columns(columns):
+            if values.dtype.kind == 'O':
+                values = values.astype(np.unicode_)
+            self.columns.append((name, values))
+
+        lengths = set(len(values) for _, values in self.columns)
+        if len(lengths) > 1:
+            raise ValueError("columns differ in length")
+        self.num_rows = lengths.pop() if lengths else 0
+
+        formats = formats or {}
+        self.fmts = [formats.get(name, self.formats.get(values.dtype.kind, "%s"))
+                     for name, values in self.columns]
+        self.widths = [min(max(column_width(values, fmt), text_width(unicode(name))), max_width)
+                       for (name, values), fmt in zip(self.columns, self.fmts)]
+        self.right = [values.dtype.kind in 'fiu' for _, values in self.columns]
+
+        self.show_index = show_index
+        self.index_width = len(str(max(self.num_rows - 1, 0)))
+        self.stripe_color = stripe_color
+        self.header_color = header_color
+
+        # first row and first column in view
+        self.top = 0
+        self.first_col = 0
+
+    @property
+    def page_size(self):
+        return self.size.row - 1
+
+    def scroll(self, rows):
+        self.top = max(0, min(self.top + rows, self.num_rows - self.page_size))
+
+    def page_down(self):
+        self.scroll(self.page_size)
+
+    def page_up(self):
+        self.scroll(-self.page_size)
+
+    def goto(self, row):
+        self.top = 0
+        self.scroll(row)
+
+    def scroll_cols(self, cols):
+        self.first_col = max(0, min(self.first_col + cols, len(self.columns) - 1))
+
+    def format_column(self, i, start, stop):
+        """
+        cells of column i in rows [start, stop), padded to the column width
+        """
+        values = self.columns[i][1][start:stop]
+        width = self.widths[i]
+        texts = np.char.mod(self.fmts[i], values) if self.fmts[i] != "%s" else values.astype(np.unicode_)
+        texts = texts.astype(np.unicode_)
+
+        justify = np.char.rjust if self.right[i] else np.char.ljust
+        cells = justify(texts, width).astype('<U%d' % width).tolist()
+
+        # 宽字符按显示宽度补齐或截断，结果可能多于width个字符
+        # wide characters are padded and cut by display width, which may take
+        # more than width code points.
+        if texts.dtype.kind == 'U':
+            for j, text in enumerate(texts.tolist()):
+                if text_width(text) != len(text):
+                    text = col_slice(text, 0, width)
+                    cells[j] = rjust(text, width) if self.right[i] else ljust(text, width)
+        return cells
+
+    def lines(self):
+        """
+        header and visible rows as whole lines
+        """
+        start, stop = self.top, min(self.top + self.page_size, self.num_rows)
+        shown = range(self.first_col, len(self.columns))
+
+        header = [(rjust if self.right[i] else ljust)(unicode(self.columns[i][0]), self.widths[i])
+                  for i in shown]
+        header = [col_slice(h, 0, self.widths[i]) for i, h in zip(shown, header)]
+        columns = [self.format_column(i, start, stop) for i in shown]
+        rows = zip(*columns) if columns else [()] * (stop - start)
+
+        if self.show_index:
+            header.insert(0, u" " * self.index_width)
+            indices = np.char.rjust(np.arange(start, stop).astype(str), self.index_width)
+            rows = [(index,) + row for index, row in zip(indices.tolist(), rows)]
+
+        return [u"  ".join(header)] + [u"  ".join(row) for row in rows]
+
+    def render_rect(self, pos, covered=()):
+
+        origin = self.pos + pos
+        strokes = []
+        for line, text in enumerate(self.lines()):
+            text = col_slice(ljust(text, self.size.col), 0, self.size.col)
+            if line == 0:
+                color = self.header_color
+            else:
+                color = self.stripe_color if (self.top + line) % 2 == 0 else self.color
+            strokes.append(Stroke(origin + Pos(line, 0), text, color))
+
+        # rows below the end of table
+        for line in range(len(strokes), self.size.row):
+            strokes.append(Stroke(origin + Pos(line, 0), u" " * self.size.col, self.color))
+        return strokes
+
+
+class ColorBar(Rect):
+    """
+    Gradient of a color scheme with min/max labels. A half block draws two
+    colors per cell, doubling the resolution along the bar.
+    """
+
+    # strokes relative to the bar, keyed by (color_scheme, length, vertical,
+    # vrange, thickness).
+    stroke_cache = {}
+
+    # labels don't fill the whole rect
+    opaque = False
+
+    def __init__(self,
+                 pos=Pos(0, 0),
+                 length=20,
+                 vrange=(0., 1.),
+                 color_scheme="Sandy",
+                 vertical=True,
+                 thickness=2,
+                 color=FullColor((240, 240, 240))):
+
+        self.length = length
+        self.vrange = tuple(vrange)
+        self.color_scheme = color_scheme
+        self.vertical = vertical
+        self.thickness = thickness
+        self.labels = ("%.3g" % vrange[0], "%.3g" % vrange[1])
+
+        label_width = max(len(l) for l in self.labels)
+        if vertical:
+            size = Pos(length, thickness + 1 + label_width)
+        else:
+            size = Pos(thickness + 1, length)
+
+        Rect.__init__(self, pos, size, "", color)
+
+    def layout(self):
+
+        scheme = color_func[self.color_scheme]
+        first, second = gradient_cells(self.length)
+        strokes = []
+
+        if self.vertical:
+            for l in range(self.length):
+                color = FullColor(scheme(1 - first[l]), scheme(1 - second[l]))
+                strokes.append(Stroke(Pos(l, 0), HALF_BLOCK[True] * self.thickness, color))
+            label_col = self.thickness + 1
+            strokes.append(Stroke(Pos(0, label_col), self.labels[1], self.color))
+            strokes.append(Stroke(Pos(self.length - 1, label_col), self.labels[0], self.color))
+        else:
+            line = []
+            for l in range(self.length):
+                color = FullColor(scheme(first[l]), scheme(second[l]))
+                line.append(Stroke(Pos(0, l), HALF_BLOCK[False], color))
+            for r in range(self.thickness):
+                strokes.extend(Stroke(s.pos + Pos(r, 0), s.text, s.color) for s in line)
+            max_col = self.length - text_width(self.labels[1])
+            strokes.append(Stroke(Pos(self.thickness, 0), self.labels[0], self.color))
+            strokes.append(Stroke(Pos(self.thickness, max_col), self.labels[1], self.color))
+
+        return strokes
+
+    def render_rect(self, pos, covered=()):
+
+        key = (self.color_scheme, self.length, self.vertical, self.vrange,
+               self.thickness)
+        if key not in ColorBar.stroke_cache:
+            if len(ColorBar.stroke_cache) >= MAX_CACHED_LAYOUTS:
+                ColorBar.stroke_cache.clear()
+            ColorBar.stroke_cache[key] = self.layout()
+
+        base = self.pos + pos
+        return [Stroke(base + s.pos, s.text, s.color)
+                for s in ColorBar.stroke_cache[key]]
 
-        table = [[ table_item(c, minval, maxval, color_scheme) for c in line] for line in table]
-        Grid.__init__(self, Pos(0, 0), table, grid_size)
 
 class Frame(Rect):
 
+    # border strokes relative to the bordered box as [(row, col, text)],
+    # keyed by (size, sides, ticks, corner_style, margin, tick positions).
+    template_cache = {}
+
     def __init__(self,
                  pos=Pos(0, 0),
                  rect=Rect(),
@@ -350,21 +1065,94 @@ class Frame(Rect):
                  frame_margin = Pos(2, 4),
                  tick_rep = Pos(3, 6),
                  tick_off = Pos(1, 5),
-                 corner_style = 'round'
+                 corner_style = 'round',
+                 x_scale = None,
+                 y_scale = None
                  ):
 
-        Rect.__init__(self, text="", size=rect.size + frame_margin)
+        # 坐标轴数字占用的空间：下方一行，左侧为最长的标签宽度加一格空隙
+        # room for tick labels, one line below the bottom axis, and the widest
+        # label plus a space on the left of left axis.
+        label_room = Pos(0, 0)
+        if x_scale is not None:
+            label_room.row = 1
+        if y_scale is not None:
+            label_room.col = y_scale.label_width(rect.size.row,
+                                                 VERT_TICK_SPACING, True) + 1
+
+        Rect.__init__(self, pos=pos, text="",
+                      size=rect.size + frame_margin + label_room)
 
         self.frame_margin = frame_margin
+        self.label_room = label_room
         self.sides = sides
         self.ticks = ticks
-        rect.pos = rect.pos + frame_margin * Pos(0.5, 0.5)
+        rect.pos = rect.pos + frame_margin * Pos(0.5, 0.5) + Pos(0, label_room.col)
         self.add_child(rect)
+        self.rect = rect
         self.corner_style = corner_style
         self.tick_rep = tick_rep
         self.tick_off = tick_off
+        self.x_scale = x_scale
+        self.y_scale = y_scale
+
+    def tick_positions(self, size, margin):
+        """
+        returns tick columns of horizontal axes and tick rows of vertical axes,
+        counted from the top-left corner of frame.
+        """
+
+        if self.x_scale is None:
+            hori = [p for p in range(size.col)
+                    if (p - self.tick_off.col) % self.tick_rep.col == 0]
+        else:
+            hori = [margin.col + off
+                    for off, _ in self.x_scale.ticks(self.rect.size.col)]
+
+        if self.y_scale is None:
+            vert = [p for p in range(1, size.row)
+                    if (p - self.tick_off.row) % self.tick_rep.row == 0]
+        else:
+            vert = [margin.row + off for off, _ in self.y_scale.ticks(
+                    self.rect.size.row, VERT_TICK_SPACING, True)]
+
+        return hori, vert
+
+    def render_labels(self, pos, size, margin):
+
+        strokes = []
+
+        if self.x_scale is not None:
+            ticks = [(margin.col + off, label)
+                     for off, label in self.x_scale.ticks(self.rect.size.col)]
+            for col, label in place_labels(ticks, size.col + 1):
+                label_pos = pos + Pos(size.row + 1, col + self.label_room.col)
+                strokes.append(Stroke(label_pos, label, self.color))
+
+        if self.y_scale is not None:
+            width = self.label_room.col - 1
+            for off, label in self.y_scale.ticks(self.rect.size.row,
+                                                 VERT_TICK_SPACING, True):
+                label_pos = pos + Pos(margin.row + off, 0)
+                strokes.append(Stroke(label_pos, rjust(label, width), self.color))
 
-    def render_rect(self, pos):
+        return strokes
+
+    def cover_boxes(self, pos):
+        # the bordered box is fully painted, while the label room is not
+        top, left, bottom, right = self.box(pos)
+        return [(top, left + self.label_room.col, bottom - self.label_room.row, right)]
+
+    def template(self, size, margin, hori_tick_pos, vert_tick_pos):
+        """
+        border of the bordered box as [(row, col, text)]. Each row of the
+        border is built once as whole strings, and cached.
+        """
+
+        key = (size.row, size.col, tuple(self.sides), tuple(self.ticks),
+               self.corner_style, margin.col, tuple(hori_tick_pos), tuple(vert_tick_pos))
+        if key in Frame.template_cache:
+            return Frame.template_cache[key]
 
         corner_styles = {
             'rect' : [u"┌", u"└", u"┘", u"┐"],
@@ -377,53 +1165,123 @@ class Frame(Rect):
         hori_tick = u"┴"
         vert_tick = u"├"
 
-
-        size = self.size + Pos(-1, -1)
-        pos = self.pos + pos
-        margin = self.frame_margin * Pos(0.5, 0.5)
-
-        hori_tick_pos = [p for p in range(size.col) if (p - self.tick_off.col) % self.tick_rep.col == 0]
-        print hori_tick_pos
-        strokes = []
-
-        ### fill up the background
-        for line in range(0, size.row+1):
-            strokes.append(Stroke(pos+Pos(line, 0), " "*size.col, self.color))
+        # 每行先按字符摆好，None表示不画，再把连续的字符合成一个Stroke
+        # cells of each row are laid out first, None for not drawn, then
+        # consecutive cells are joined into one piece of text.
+        rows = [[None] * (size.col + 1) for _ in range(size.row + 1)]
 
         ### top and bottom axes
         if 'bottom' in self.sides:
-            bottom_str = HORI_BAR * size.col
+            rows[size.row][:size.col] = [HORI_BAR] * size.col
             if 'bottom' in self.ticks:
                 for i in hori_tick_pos:
-                    bottom_str = bottom_str[:i] + hori_tick + bottom_str[i+1:]
-            strokes.append(Stroke(pos+Pos(size.row,0), bottom_str, self.color))
+                    if 0 <= i < size.col:
+                        rows[size.row][i] = hori_tick
         if 'top' in self.sides:
-            strokes.append(Stroke(pos, HORI_BAR * size.col, self.color))
+            rows[0][:size.col] = [HORI_BAR] * size.col
 
         ### left and right axes
-        if 'left' in self.sides:
-            for line in range(1,size.row):
-                strokes.append(Stroke(Pos(line, 0), VERT_BAR + (" " * (margin.col-1)), self.color))
-
-        if 'right' in self.sides:
-            for line in range(1,size.row):
-                strokes.append(Stroke(Pos(line, size.col - margin.col+1), (" " * (margin.col-1)) + VERT_BAR, self.color))
+        vert_tick_pos = set(vert_tick_pos)
+        for line in range(1, size.row):
+            if 'left' in self.sides:
+                bar = vert_tick if 'left' in self.ticks and line in vert_tick_pos else VERT_BAR
+                rows[line][:margin.col] = [bar] + [u" "] * (margin.col - 1)
+            if 'right' in self.sides:
+                rows[line][size.col - margin.col + 1:] = [u" "] * (margin.col - 1) + [VERT_BAR]
 
         ### corners
         corner_cond = [('left','top'),('left', 'bottom'), ('right','bottom'), ('right', 'top')]
         for corner, char, (cond0, cond1) in zip(size.corners(), corners, corner_cond):
             if cond0 in self.sides or cond1 in self.sides:
-                strokes.append(Stroke(pos+corner, char, self.color))
+                rows[corner.row][corner.col] = char
+
+        template = []
+        for line, cells in enumerate(rows):
+            for drawn, run in itertools.groupby(enumerate(cells), lambda c: c[1] is not None):
+                if drawn:
+                    run = list(run)
+                    template.append((line, run[0][0], u"".join(ch for _, ch in run)))
+
+        if len(Frame.template_cache) >= MAX_CACHED_LAYOUTS:
+            Frame.template_cache.clear()
+        Frame.template_cache[key] = template
+        return template
+
+    def render_rect(self, pos, covered=()):
+
+        # size of the bordered box, without the room for labels
+        size = Pos(self.size.row - self.label_room.row - 1,
+                   self.size.col - self.label_room.col - 1)
+        label_pos = self.pos + pos
+        pos = label_pos + Pos(0, self.label_room.col)
+        margin = self.frame_margin * Pos(0.5, 0.5)
+
+        hori_tick_pos, vert_tick_pos = self.tick_positions(size, margin)
+        strokes = [Stroke(pos + Pos(line, col), text, self.color)
+                   for line, col, text in self.template(size, margin, hori_tick_pos, vert_tick_pos)]
+
+        ### fill up the background, except for parts covered by the borders
+        ### or the content
+        fills = []
+        covered = list(covered) + [rs.box() for rs in strokes]
+        for line in range(0, size.row+1):
+            row = pos.row + line
+            for left, right in uncovered_spans(row, pos.col, pos.col + size.col + 1, covered):
+                fills.append(Stroke(Pos(row, left), " " * (right - left), self.color))
+
+        return fills + strokes + self.render_labels(label_pos, size, margin)
 
-        return strokes
+
+class LineChart(Rect):
+
+    def __init__(self,
+                 pos=Pos(0, 0),
+                 data=(),
+                 size=Pos(8, 40),
+                 style="braille",
+                 vrange=None,
+                 color=FullColor((240, 240, 240), (20, 20, 20))):
+
+        Rect.__init__(self, pos, size, "", color)
+
+        self.data = data
+        self.style = style
+        self.vrange = vrange
+
+    def render_rect(self, pos, covered=()):
+
+        lines = line_raster[self.style](self.data, self.size.col,
+                                        self.size.row, self.vrange)
+        return [Stroke(self.pos + pos + Pos(l, 0), text, self.color)
+                for l, text in enumerate(lines)]
+
+
+class Sparkline(LineChart):
+
+    def __init__(self,
+                 pos=Pos(0, 0),
+                 data=(),
+                 width=40,
+                 vrange=None,
+                 color=FullColor((240, 240, 240), (20, 20, 20))):
+
+        LineChart.__init__(self, pos, data, Pos(1, width), "block", vrange, color)
 
 
 if __name__ == "__main__":
 
+    # columns of wide or combining characters only, and mixed with plain ones
+    for texts, width in [([u"Иван", u"Пётр"], 4), ([u"中文", u"日本語"], 6),
+                         ([u"e\u0301te", u"abcde"], 5)]:
+        assert column_width(np.array(texts), "%s") == width, texts
+        Table(columns={'n': np.array(texts)})
+    print "column widths of unicode columns checked"
+
     grid = np.random.random_sample(((8, 10)))
 
     canvas = Canvas()
     heat_map = Heatmap(table=grid.tolist())
-    frame    = Frame(rect=heat_map, ticks=('bottom'))
+    frame    = Frame(rect=heat_map, x_scale=heat_map.x_scale,
+                     y_scale=heat_map.y_scale)
     canvas.add_child(frame)
     canvas.draw()
@@ -0,0 +1,225 @@
+# -*- encoding: utf-8 -*-
+
+"""
+A rendered frame as plain arrays: one glyph per cell plus palette indices of
+its fore and back color. Both the Canvas API and the Rect tree can render
+into it, and it can be encoded back into escape sequences row by row.
+"""
+
+import numpy as np
+
+from palette import COL_FORE, COL_BACK, COL_RESET, COL_SEQ, COL_SEQ_256, nearest_256
+from textwidth import char_width, text_width
+
+
+def clamp_rgb(rgb):
+    return tuple(min(max(int(c), 0), 255) for c in rgb)
+
+
+class FrameBuffer:
+
+    def __init__(self, rows, cols):
+
+        self.rows = rows
+        self.cols = cols
+
+        # the right half of a wide character holds an empty glyph
+        self.glyphs = np.empty((rows, cols), dtype='<U1')
+        self.glyphs[:] = u" "
+        self.fg = np.zeros((rows, cols), dtype=np.uint16)
+        self.bg = np.zeros((rows, cols), dtype=np.uint16)
+
+        # cells written by put(), which a layer covers when overlaid
+        self.painted = np.zeros((rows, cols), dtype=bool)
+
+        # palette index 0 is black, which blank cells have
+        self.palette = [(0, 0, 0)]
+        self.palette_index = {(0, 0, 0): 0}
+
+    def color_id(self, rgb):
+        if rgb not in self.palette_index:
+            self.palette_index[rgb] = len(self.palette)
+            self.palette.append(rgb)
+        return self.palette_index[rgb]
+
+    def put(self, row, col, text, fore, back):
+        """
+        write text with fore and back colors as (r, g, b), starting at given
+        cell and clipped to the buffer.
+        """
+        if not 0 <= row < self.rows:
+            return
+
+        fore = self.color_id(clamp_rgb(fore))
+        back = self.color_id(clamp_rgb(back))
+        text = unicode(text)
+
+        # plain narrow text is written in one go
+        if text_width(text) == len(text):
+            left, right = max(col, 0), min(col + len(text), self.cols)
+            if left < right:
+                self.clear_wide_edges(row, left, right)
+                self.glyphs[row, left:right] = list(text[left-col:right-col])
+                self.fg[row, left:right] = fore
+                self.bg[row, left:right] = back
+                self.painted[row, left:right] = True
+            return
+
+        for ch in text:
+            width = char_width(ch)
+            if width == 0:
+                continue
+            if 0 <= col and col + width <= self.cols:
+                self.clear_wide_edges(row, col, col + width)
+                self.glyphs[row, col] = ch
+                self.glyphs[row, col+1:col+width] = u""
+                self.fg[row, col:col+width] = fore
+                self.bg[row, col:col+width] = back
+                self.painted[row, col:col+width] = True
+            col += width
+
+    def clear_wide_edges(self, row, left, right):
+        """
+        don't leave half of a wide character behind when overwriting cells
+        [left, right).
+        """
+        if left > 0 and self.glyphs[row, left] == u"":
+            self.glyphs[row, left-1] = u" "
+        if right < self.cols and self.glyphs[row, right] == u"":
+            self.glyphs[row, right] = u" "
+
+    def intern_rgb(self, rgb):
+        """
+        palette indices of an (..., 3) array of colors, adding new colors to
+        the palette. Each distinct color is looked up once.
+        """
+        rgb = np.clip(np.rint(rgb), 0, 255).astype(np.uint32)
+        packed = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+        uniq, inverse = np.unique(packed, return_inverse=True)
+        ids = np.array([self.color_id((int(p >> 16), int(p >> 8 & 255), int(p & 255))) for p in uniq.tolist()],
+                       dtype=np.uint16)
+        return ids[inverse].reshape(packed.shape)
+
+    def blend(self, rgb, alpha, region=None, planes=("fg", "bg")):
+        """
+        blend a color over cells of region (top, left, bottom, right), the
+        whole buffer by default.
+
+        rgb:    (r, g, b), or an array of colors of the region's shape + (3,)
+        alpha:  opacity, a number or an array of the region's shape
+        planes: fore and/or back colors to blend
+        """
+        top, left, bottom, right = region or (0, 0, self.rows, self.cols)
+        rgb = np.asarray(rgb, dtype=float)
+        alpha = np.asarray(alpha, dtype=float)
+
+        # clip region to the buffer, and per cell colors and opacities along
+        clipped = (slice(max(-top, 0), min(bottom, self.rows) - top),
+                   slice(max(-left, 0), min(right, self.cols) - left))
+        if rgb.ndim == 3:
+            rgb = rgb[clipped]
+        if alpha.ndim == 2:
+            alpha = alpha[clipped]
+        if alpha.ndim:
+            alpha = alpha[..., None]
+        top, left = max(top, 0), max(left, 0)
+        bottom, right = min(bottom, self.rows), min(right, self.cols)
+        if top >= bottom or left >= right:
+            return
+
+        palette = self.palette_array().astype(float)
+        for plane in planes:
+            ids = getattr(self, plane)[top:bottom, left:right]
+            under = palette[ids]
+            ids[:] = self.intern_rgb(under + alpha * (rgb - under))
+
+    def overlay(self, layer, alpha=1.):
+        """
+        blend a frame buffer of the same size over this one with opacity
+        alpha. Only cells painted on layer are affected: backgrounds are
+        blended, glyphs of layer replace those below with their color
+        blended over the background below, and glyphs below blank cells of
+        layer are tinted by its background.
+        """
+        if (layer.rows, layer.cols) != (self.rows, self.cols):
+            raise ValueError("frame buffers differ in size")
+        mask = layer.painted
+        if not mask.any():
+            return
+
+        palette = self.palette_array().astype(float)
+        layer_palette = layer.palette_array().astype(float)
+        under_fg, under_bg = palette[self.fg[mask]], palette[self.bg[mask]]
+        top_fg, top_bg = layer_palette[layer.fg[mask]], layer_palette[layer.bg[mask]]
+
+        glyphs = layer.glyphs[mask]
+        ink = (glyphs != u" ")[:, None]
+        fg = np.where(ink, under_bg + alpha * (top_fg - under_bg),
+                           under_fg + alpha * (top_bg - under_fg))
+        bg = under_bg + alpha * (top_bg - under_bg)
+
+        self.glyphs[mask] = np.where(ink[:, 0], glyphs, self.glyphs[mask])
+        self.fg[mask] = self.intern_rgb(fg)
+        self.bg[mask] = self.intern_rgb(bg)
+        self.painted |= mask
+
+    def palette_array(self):
+        return np.array(self.palette, dtype=np.uint8).reshape(-1, 3)
+
+    def rgb(self):
+        """
+        fore and back colors as (rows, cols, 3) uint8 arrays
+        """
+        palette = self.palette_array()
+        return palette[self.fg], palette[self.bg]
+
+    def row_runs(self, row):
+        """
+        split a row into runs of the same colors, returns [(fg, bg, text)]
+        """
+        fg, bg = self.fg[row], self.bg[row]
+        change = np.flatnonzero((fg[1:] != fg[:-1]) | (bg[1:] != bg[:-1])) + 1
+        bounds = [0] + change.tolist() + [self.cols]
+
+        glyphs = self.glyphs[row]
+        return [(int(fg[l]), int(bg[l]), u"".join(glyphs[l:r]))
+                for l, r in zip(bounds[:-1], bounds[1:])]
+
+    def encode_row(self, row, depth=24):
+        """
+        escape sequences of a row, in truecolor or (depth 8) 256 colors
+        """
+        strokes = []
+        for fore, back, text in self.row_runs(row):
+            if depth == 8:
+                strokes.append(COL_SEQ_256.format(z=COL_FORE, n=nearest_256(self.palette[fore])))
+                strokes.append(COL_SEQ_256.format(z=COL_BACK, n=nearest_256(self.palette[back])))
+            else:
+                fr, fg, fb = self.palette[fore]
+                br, bg, bb = self.palette[back]
+                strokes.append(COL_SEQ.format(z=COL_FORE, r=fr, g=fg, b=fb))
+                strokes.append(COL_SEQ.format(z=COL_BACK, r=br, g=bg, b=bb))
+            strokes.append(text)
+        return u"".join(strokes) + COL_RESET
+
+    def changed_cells(self, other):
+        """
+        (rows, cols) bool array of cells differing from another frame buffer
+        of the same size.
+        """
+        if (other.rows, other.cols) != (self.rows, self.cols):
+            raise ValueError("frame buffers differ in size")
+
+        # palettes may differ, thus compare colors instead of their indices
+        self_fg, self_bg = self.rgb()
+        other_fg, other_bg = other.rgb()
+        return (self.glyphs != other.glyphs) | \
+               (self_fg != other_fg).any(axis=2) | (self_bg != other_bg).any(axis=2)
+
+    def changed_rows(self, other):
+        """
+        rows differing from another frame buffer of the same size
+        """
+        if other is None or (other.rows, other.cols) != (self.rows, self.cols):
+            return range(self.rows)
+        return np.flatnonzero(self.changed_cells(other).any(axis=1)).tolist()
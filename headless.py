@@ -0,0 +1,200 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Headless output. A canvas renders into a FrameBuffer (Canvas.frame_buffer()
+or Rect.frame_buffer()), which is exported from its arrays directly: no
+escape sequence is written or parsed back.
+
+    fb = canvas.frame_buffer()
+    open("chart.html", "w").write(to_html(fb).encode("utf-8"))
+    pixels = to_pixels(fb)                   # (rows*8, cols*4, 3) uint8
+
+Golden frames for tests are stored as .npz and compared cell by cell:
+
+    save_golden(fb, "heatmap.npz")
+    assert compare_golden(fb, "heatmap.npz") == 0
+"""
+
+import unicodedata
+
+import numpy as np
+
+from framebuffer import FrameBuffer
+from textwidth import text_width
+
+# cell size in pixels of to_pixels, and of to_svg
+PIXEL_CELL = (8, 4)
+SVG_CELL = (16, 8)
+
+BRAILLE_BASE = 0x2800
+
+# braille dot bit -> (row, col) of the dot in the 4x2 matrix
+BRAILLE_DOTS = [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1), (3, 0), (3, 1)]
+
+# glyph masks keyed by (glyph, height, width)
+mask_cache = {}
+
+
+def hex_color(rgb):
+    return "#%02x%02x%02x" % tuple(rgb)
+
+
+def escape_xml(text):
+    return text.replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u">", u"&gt;")
+
+
+def row_spans(fb, row):
+    """
+    runs of a row as [(col, width, fg, bg, text)]
+    """
+    spans = []
+    col = 0
+    for fore, back, text in fb.row_runs(row):
+        width = text_width(text)
+        spans.append((col, width, fore, back, text))
+        col += width
+    return spans
+
+
+def to_html(fb):
+    """
+    a <pre> block with one span per run of the same colors
+    """
+    palette = [hex_color(rgb) for rgb in fb.palette]
+
+    lines = []
+    for row in range(fb.rows):
+        lines.append(u"".join(
+            u'<span style="color:%s;background:%s">%s</span>' % (
+                palette[fore], palette[back], escape_xml(text))
+            for _, _, fore, back, text in row_spans(fb, row)))
+
+    return u'<pre style="font-family:monospace;line-height:1">\n%s\n</pre>\n' % u"\n".join(lines)
+
+
+def to_svg(fb, cell=SVG_CELL):
+    """
+    an svg with a rect for the background and a text for the glyphs of each
+    run, cell is (height, width) of a cell in pixels.
+    """
+    height, width = cell
+    palette = [hex_color(rgb) for rgb in fb.palette]
+
+    elems = []
+    for row in range(fb.rows):
+        y = row * height
+        for col, span, fore, back, text in row_spans(fb, row):
+            x = col * width
+            elems.append(u'<rect x="%d" y="%d" width="%d" height="%d" fill="%s"/>' % (
+                x, y, span * width, height, palette[back]))
+            if text.strip():
+                elems.append(u'<text x="%d" y="%d" fill="%s" textLength="%d" '
+                             u'lengthAdjust="spacingAndGlyphs">%s</text>' % (
+                                 x, y + height * 0.8, palette[fore], span * width,
+                                 escape_xml(text)))
+
+    return (u'<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+            u'font-family="monospace" font-size="%d" xml:space="preserve">\n%s\n</svg>\n') % (
+                fb.cols * width, fb.rows * height, height, u"\n".join(elems))
+
+
+def glyph_mask(glyph, height, width):
+    """
+    (height, width) bool array of pixels of a cell painted in its fore color.
+    Blocks, braille and box drawing characters are drawn as they look, other
+    glyphs as a box in the middle of the cell.
+    """
+    key = (glyph, height, width)
+    if key in mask_cache:
+        return mask_cache[key]
+
+    mask = np.zeros((height, width), dtype=bool)
+    mid_row, mid_col = height // 2, width // 2
+    code = ord(glyph) if len(glyph) == 1 else None
+
+    if glyph == u" ":
+        pass
+    elif glyph == u"█":
+        mask[:] = True
+    elif glyph == u"▀":
+        mask[:mid_row] = True
+    elif glyph == u"▄":
+        mask[mid_row:] = True
+    elif glyph == u"▌":
+        mask[:, :mid_col] = True
+    elif glyph == u"▐":
+        mask[:, mid_col:] = True
+    elif code is not None and BRAILLE_BASE <= code < BRAILLE_BASE + 256:
+        dot_h, dot_w = max(height // 4, 1), max(width // 2, 1)
+        for bit, (r, c) in enumerate(BRAILLE_DOTS):
+            if (code - BRAILLE_BASE) >> bit & 1:
+                mask[r*dot_h:(r+1)*dot_h, c*dot_w:(c+1)*dot_w] = True
+    elif code is not None and unicodedata.name(glyph, "").startswith("BOX DRAWINGS"):
+        # 按字符名里的方向画出线段
+        # arms of a box drawing character are told by its name
+        words = unicodedata.name(glyph).split()
+        if "HORIZONTAL" in words or "LEFT" in words:
+            mask[mid_row, :mid_col+1] = True
+        if "HORIZONTAL" in words or "RIGHT" in words:
+            mask[mid_row, mid_col:] = True
+        if "VERTICAL" in words or "UP" in words:
+            mask[:mid_row+1, mid_col] = True
+        if "VERTICAL" in words or "DOWN" in words:
+            mask[mid_row:, mid_col] = True
+    else:
+        # the right half of a wide character is inked as well
+        mask[height//4:height - height//4, width//4:width - width//4] = True
+
+    mask_cache[key] = mask
+    return mask
+
+
+def to_pixels(fb, cell=PIXEL_CELL):
+    """
+    (rows*height, cols*width, 3) uint8 image of the frame, cell is (height,
+    width) of a cell in pixels. Each distinct glyph is rasterized once.
+    """
+    height, width = cell
+    fore, back = fb.rgb()
+
+    glyphs, inverse = np.unique(fb.glyphs, return_inverse=True)
+    masks = np.array([glyph_mask(g, height, width) for g in glyphs], dtype=bool)
+    masks = masks.reshape(-1, height, width)[inverse].reshape(fb.rows, fb.cols, height, width)
+
+    pixels = np.where(masks[..., None], fore[:, :, None, None, :], back[:, :, None, None, :])
+    return pixels.transpose(0, 2, 1, 3, 4).reshape(fb.rows * height, fb.cols * width, 3)
+
+
+def save_golden(fb, path):
+    fore, back = fb.rgb()
+    np.savez_compressed(path, glyphs=fb.glyphs, fore=fore, back=back)
+
+
+def load_golden(path):
+    """
+    FrameBuffer saved by save_golden
+    """
+    data = np.load(path)
+    glyphs, fore, back = data["glyphs"], data["fore"], data["back"]
+
+    fb = FrameBuffer(*glyphs.shape)
+    fb.glyphs[:] = glyphs
+
+    # the palette is rebuilt from distinct colors of both planes
+    colors, inverse = np.unique(np.concatenate([fore, back]).reshape(-1, 3),
+                                axis=0, return_inverse=True)
+    fb.palette = [tuple(c) for c in colors.tolist()]
+    fb.palette_index = dict((c, i) for i, c in enumerate(fb.palette))
+    inverse = inverse.reshape(2, fb.rows, fb.cols)
+    fb.fg[:], fb.bg[:] = inverse[0], inverse[1]
+    return fb
+
+
+def compare_golden(fb, path):
+    """
+    number of cells differing from a golden frame, -1 if sizes differ
+    """
+    golden = load_golden(path)
+    if (golden.rows, golden.cols) != (fb.rows, fb.cols):
+        return -1
+    return int(fb.changed_cells(golden).sum())
@@ -0,0 +1,224 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Normalization of values into [0, 1] for coloring, robust to outliers.
+
+    norm = Norm('linear', clip=(2, 98))     # ignore the extreme 2% each side
+    norm = Norm('log')
+    norm = Norm('diverging', center=0.)     # symmetric around center
+
+The range of in-memory arrays is found with np.partition. For chunked or
+live input a QuantileSketch keeps a bounded summary of everything seen, and
+sketches of separate chunks can be merged. norm.sketch() makes one suited to
+the mode, in log mode it keeps positive values only:
+
+    sketch = norm.sketch()
+    for chunk in chunks:
+        sketch.update(chunk)
+    vrange = norm.sketch_range(sketch)
+    colors = norm(values, vrange)
+"""
+
+import numpy as np
+
+MODES = ('linear', 'log', 'diverging')
+
+
+def finite(values):
+    values = np.asarray(values, dtype=float).ravel()
+    return values[np.isfinite(values)]
+
+
+def partition_quantiles(values, qs):
+    """
+    quantiles qs (in [0, 1]) of a flat array, by partial sorting
+    """
+    if len(values) == 0:
+        return [0.] * len(qs)
+    index = [int(round(q * (len(values) - 1))) for q in qs]
+    part = np.partition(values, index)
+    return [float(part[i]) for i in index]
+
+
+class Norm:
+
+    def __init__(self, mode='linear', clip=None, center=0.):
+        """
+        mode:   'linear', 'log' or 'diverging'
+        clip:   (low, high) percentiles the range is clipped to, or None for
+                min and max
+        center: value mapped to the middle in diverging mode
+        """
+        if mode not in MODES:
+            raise ValueError("mode must be one of %s" % ", ".join(MODES))
+        self.mode = mode
+        self.clip = clip
+        self.center = center
+
+    def quantiles(self):
+        if self.clip is None:
+            return (0., 1.)
+        return (self.clip[0] / 100., self.clip[1] / 100.)
+
+    def fix_range(self, lo, hi):
+        if self.mode == 'diverging':
+            extent = max(abs(lo - self.center), abs(hi - self.center))
+            return (self.center - extent, self.center + extent)
+        return (lo, hi)
+
+    def value_range(self, values):
+        """
+        (lo, hi) mapped to 0 and 1, from an in-memory array
+        """
+        values = finite(values)
+        if self.mode == 'log':
+            values = values[values > 0]
+
+        if self.clip is None and len(values):
+            return self.fix_range(float(values.min()), float(values.max()))
+        return self.fix_range(*partition_quantiles(values, self.quantiles()))
+
+    def sketch(self, k=256, seed=None):
+        """
+        QuantileSketch for sketch_range, of positive values only in log mode
+        """
+        return QuantileSketch(k, seed, positive=self.mode == 'log')
+
+    def sketch_range(self, sketch):
+        """
+        (lo, hi) mapped to 0 and 1, from a QuantileSketch
+        """
+        # 对数模式下0和负数会把下限拉到-690，所有正数都挤到1附近
+        # zeros in log mode would pull lo down to log(1e-300), squeezing all
+        # positive values near 1, as value_range drops them so must the sketch
+        if self.mode == 'log' and not sketch.positive:
+            raise ValueError("log mode needs a sketch of positive values, see Norm.sketch()")
+        return self.fix_range(*sketch.quantiles(self.quantiles()))
+
+    def __call__(self, values, vrange=None, out=None):
+        """
+        values mapped into [0, 1], values outside of vrange are clipped.
+        vrange is found from values if not given.
+
+        out: float array of the shape of values the result is written into.
+             Nothing else is allocated then, unless vrange has to be found.
+        """
+        values = np.asarray(values, dtype=float)
+        if vrange is None:
+            vrange = self.value_range(values)
+        lo, hi = vrange
+        if out is None:
+            out = np.empty(values.shape)
+
+        # 非正数取对数前换成极小值，归一化后落在0
+        # non-positive values become tiny before the log, and end up at 0
+        if self.mode == 'log':
+            lo, hi = np.log(max(lo, 1e-300)), np.log(max(hi, 1e-300))
+            np.maximum(values, 1e-300, out=out)
+            np.log(out, out=out)
+        else:
+            np.copyto(out, values)
+
+        span = hi - lo
+        if span <= 0:
+            out.fill(0.)
+            return out
+        np.subtract(out, lo, out=out)
+        np.divide(out, span, out=out)
+
+        # fmax takes 0 over nan, clipping without temporary masks
+        np.fmax(out, 0., out=out)
+        return np.minimum(out, 1., out=out)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile summary in bounded memory. Values are kept in levels
+    of at most k items, an item at level i standing for 2**i values. A full
+    level is sorted and every other item moves up a level, so the sketch
+    keeps O(k log(n/k)) items; rank error is about 1/k of the count.
+    With positive set, values not above 0 are left out.
+    """
+
+    def __init__(self, k=256, seed=None, positive=False):
+        self.k = k
+        self.positive = positive
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.random = np.random.RandomState(seed)
+
+    def update(self, values):
+        values = finite(values)
+        if self.positive:
+            values = values[values > 0]
+        if len(values) == 0:
+            return self
+
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compact()
+        return self
+
+    def merge(self, other):
+        """
+        add everything other has seen into this sketch
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for i, items in enumerate(other.levels):
+            self.levels[i] = np.concatenate([self.levels[i], items])
+
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compact()
+        return self
+
+    def compact(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                # 排序后隔一个取一个，保留的元素权重加倍
+                # keep every other item of the sorted level, at double weight.
+                # An odd item stays, so no weight is lost.
+                items = np.sort(items)
+                rest = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(rest)]
+                kept = items[self.random.randint(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], kept])
+                self.levels[level] = rest
+            level += 1
+
+    def __len__(self):
+        return sum(len(items) for items in self.levels)
+
+    def quantiles(self, qs):
+        if self.count == 0:
+            return [0.] * len(qs)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(l), 2. ** i) for i, l in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, ranks = items[order], np.cumsum(weights[order])
+
+        result = []
+        for q in qs:
+            if q <= 0:
+                result.append(float(self.min))
+            elif q >= 1:
+                result.append(float(self.max))
+            else:
+                i = np.searchsorted(ranks, q * ranks[-1])
+                result.append(float(items[min(i, len(items) - 1)]))
+        return result
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
@@ -0,0 +1,235 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Adaptive frame pacing for slow terminals, e.g. over ssh. A Pacer stands in
+for stdout, measures the bytes and the time spent writing each frame, and:
+
+  * skips frames while the previous one is still draining,
+  * lowers quality when frames keep taking longer than the frame budget,
+  * restores quality when the measured throughput would fit a better one.
+
+Quality levels:
+
+    0   truecolor
+    1   256 colors, shorter escape sequences
+    2   256 colors, heatmaps coarsened 2x2
+    3   256 colors, heatmaps coarsened 4x4
+
+    pacer = Pacer(fps=10)
+    while True:
+        pacer.draw(lambda coarsen: build_canvas(coarsen))
+"""
+
+import sys
+import time
+
+from palette import Palette
+
+# (color depth, coarsen factor) of each quality level
+LEVELS = [(24, 1), (8, 1), (8, 2), (8, 4)]
+
+# weight of the latest frame in running averages
+SMOOTHING = 0.3
+
+
+class Pacer:
+
+    def __init__(self, fps=10, out=sys.stdout, patience=3, headroom=0.7, clock=time.time):
+        """
+        fps:      target frame rate, frames are skipped below it
+        patience: frames in a row over (or well under) budget before the
+                  quality level changes
+        headroom: a better level is restored only if its frames are
+                  expected to take at most this part of the budget
+        clock:    current time in seconds, time.time unless simulated
+        """
+        self.out = out
+        self.clock = clock
+        self.budget = 1. / fps
+        self.patience = patience
+        self.headroom = headroom
+
+        self.level = 0
+        self.over = 0
+        self.under = 0
+
+        # running averages of throughput and of frame size at each level
+        self.throughput = None
+        self.frame_bytes = [None] * len(LEVELS)
+
+        self.next_frame = 0.
+        self.frame_written = 0
+        self.frame_time = 0.
+        self.frames = 0
+        self.skipped = 0
+
+    @property
+    def depth(self):
+        return LEVELS[self.level][0]
+
+    @property
+    def coarsen(self):
+        return LEVELS[self.level][1]
+
+    ### file interface for Canvas.out / Rect.out
+
+    def write(self, data):
+        start = self.clock()
+        self.out.write(data)
+        self.frame_time += self.clock() - start
+        self.frame_written += len(data)
+
+    def flush(self):
+        start = self.clock()
+        self.out.flush()
+        self.frame_time += self.clock() - start
+
+    ### frames
+
+    def begin_frame(self, now=None):
+        """
+        False if this frame should be skipped
+        """
+        now = self.clock() if now is None else now
+        if now < self.next_frame:
+            self.skipped += 1
+            return False
+        self.frame_start = now
+        self.frame_written = 0
+        self.frame_time = 0.
+        return True
+
+    def end_frame(self):
+
+        self.frames += 1
+        written, spent = self.frame_written, max(self.frame_time, 1e-6)
+
+        def smooth(old, new):
+            return new if old is None else old + SMOOTHING * (new - old)
+
+        self.throughput = smooth(self.throughput, written / spent)
+        self.frame_bytes[self.level] = smooth(self.frame_bytes[self.level], written)
+
+        # 上一帧还没写完之前不画下一帧
+        # the next frame waits until this one would have drained
+        self.next_frame = self.frame_start + max(self.budget, spent)
+
+        if spent > self.budget:
+            self.over, self.under = self.over + 1, 0
+        elif self.level > 0 and self.expected_time(self.level - 1) < self.budget * self.headroom:
+            self.over, self.under = 0, self.under + 1
+        else:
+            self.over = self.under = 0
+
+        if self.over >= self.patience and self.level < len(LEVELS) - 1:
+            self.level += 1
+            self.over = 0
+        elif self.under >= self.patience:
+            self.level -= 1
+            self.under = 0
+
+    def expected_time(self, level):
+        """
+        expected time writing a frame at given level takes
+        """
+        frame_bytes = self.frame_bytes[level]
+        if frame_bytes is None:
+            # not seen yet, guess from the current level
+            frame_bytes = self.frame_bytes[self.level] * (2 if level < self.level else 1)
+        return frame_bytes / self.throughput
+
+    def draw(self, build):
+        """
+        build(coarsen) returns a congram.Canvas or a congram2 Rect for this
+        frame, built with heatmaps coarsened by given factor. Returns False
+        if the frame was skipped.
+        """
+        if not self.begin_frame():
+            return False
+
+        canvas = build(self.coarsen)
+        if canvas.palette is None:
+            canvas.palette = Palette()
+        canvas.palette.set_depth(self.depth)
+        canvas.out = self
+
+        if hasattr(canvas, "draw"):
+            canvas.draw()
+        else:
+            canvas.render()
+
+        self.end_frame()
+        return True
+
+
+class SlowSink:
+    """
+    file-like sink writing at most rate bytes per second, for trying out a
+    slow link locally. sleep waits the writing time, e.g. advancing a
+    simulated clock instead.
+    """
+
+    def __init__(self, rate, sleep=time.sleep):
+        self.rate = rate
+        self.sleep = sleep
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        self.sleep(len(data) / float(self.rate))
+
+    def flush(self):
+        pass
+
+
+if __name__ == "__main__":
+
+    import numpy as np
+
+    from congram import Canvas, color_func
+    from raster import coarsen
+
+    data = np.random.random_sample((16, 16))
+
+    def build(factor):
+        canvas = Canvas(cols=120)
+        canvas.add_heatmap(coarsen(data, factor).tolist(), color_func["Sandy"])
+        return canvas
+
+    class Clock:
+        """
+        simulated time, moved on by the sink and between frames
+        """
+        def __init__(self):
+            self.now = 0.
+        def __call__(self):
+            return self.now
+        def advance(self, seconds):
+            self.now += seconds
+
+    # a fast link, then a slow one, then fast again: quality has to drop on
+    # the slow link and come back once it is fast again
+    clock = Clock()
+    sink = SlowSink(10 ** 7, sleep=clock.advance)
+    pacer = Pacer(fps=10, out=sink, clock=clock)
+    phases = []
+    for rate, seconds in [(10 ** 7, 1.), (2 * 10 ** 5, 4.), (10 ** 7, 3.)]:
+        sink.rate = rate
+        end = clock() + seconds
+        frames, skipped = pacer.frames, pacer.skipped
+        levels = []
+        while clock() < end:
+            if pacer.draw(build):
+                levels.append(pacer.level)
+            else:
+                clock.advance(0.005)
+        phases.append(levels)
+        print "%8d B/s: %3d frames, %4d skipped, levels %s" % (
+            rate, pacer.frames - frames, pacer.skipped - skipped,
+            " ".join(str(level) for level in levels))
+
+    fast, slow, recovered = phases
+    assert set(fast) == set([0]), fast
+    assert max(slow) > 0, slow
+    assert recovered[-1] == 0, recovered
+    print "quality drops on the slow link and recovers"
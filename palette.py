@@ -0,0 +1,101 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Palette interning. A frame uses a handful of distinct fore/back color pairs,
+so each pair is stored once and referred to by a small integer id. Escape
+sequences are formatted once per id, and colors compare as integers.
+"""
+
+COL_FORE = 38
+COL_BACK = 48
+COL_SEQ = '\x01\x1b[{z};2;{r};{g};{b}m\x02'
+COL_SEQ_256 = '\x01\x1b[{z};5;{n}m\x02'
+COL_RESET = '\x01\x1b[0m\x02'
+
+# levels of each channel in the 6x6x6 color cube of 256 color terminals
+CUBE_LEVELS = [0, 95, 135, 175, 215, 255]
+
+# rgb -> index in the 256 color palette
+nearest_cache = {}
+
+
+def rgb(color):
+    return (color.r, color.g, color.b)
+
+
+def nearest_256(rgb):
+    """
+    index of the closest color of the 256 color palette, out of the color
+    cube (16-231) and the gray ramp (232-255).
+    """
+    rgb = tuple(rgb)
+    if rgb in nearest_cache:
+        return nearest_cache[rgb]
+
+    clamped = [min(max(c, 0), 255) for c in rgb]
+    cube = [min(range(6), key=lambda i: abs(CUBE_LEVELS[i] - c)) for c in clamped]
+    cube_rgb = [CUBE_LEVELS[i] for i in cube]
+
+    gray = min(max(int(round((sum(clamped) / 3. - 8) / 10.)), 0), 23)
+    gray_rgb = [8 + gray * 10] * 3
+
+    def dist(other):
+        return sum((a - b) ** 2 for a, b in zip(clamped, other))
+
+    if dist(gray_rgb) < dist(cube_rgb):
+        nearest_cache[rgb] = 232 + gray
+    else:
+        nearest_cache[rgb] = 16 + 36 * cube[0] + 6 * cube[1] + cube[2]
+    return nearest_cache[rgb]
+
+
+class Palette:
+
+    def __init__(self):
+        # id -> (fore rgb, back rgb), and the other way round
+        self.colors = []
+        self.index = {}
+
+        # id -> escape sequence, filled on first use
+        self.escapes = {}
+
+        # 24 for truecolor escapes, 8 for the 256 color palette
+        self.depth = 24
+
+    def set_depth(self, depth):
+        if depth != self.depth:
+            self.depth = depth
+            self.escapes = {}
+
+    def __len__(self):
+        return len(self.colors)
+
+    def intern(self, color):
+        """
+        id of a CharColor/FullColor. Ids are returned as they are.
+        """
+        if isinstance(color, int):
+            return color
+
+        key = (rgb(color.fore), rgb(color.back))
+        try:
+            return self.index[key]
+        except KeyError:
+            self.index[key] = len(self.colors)
+            self.colors.append(key)
+            return self.index[key]
+
+    def escape(self, color_id):
+        try:
+            return self.escapes[color_id]
+        except KeyError:
+            fore, back = self.colors[color_id]
+            if self.depth == 8:
+                seq = COL_SEQ_256.format(z=COL_FORE, n=nearest_256(fore)) + \
+                      COL_SEQ_256.format(z=COL_BACK, n=nearest_256(back))
+            else:
+                (fr, fg, fb), (br, bg, bb) = fore, back
+                seq = COL_SEQ.format(z=COL_FORE, r=fr, g=fg, b=fb) + \
+                      COL_SEQ.format(z=COL_BACK, r=br, g=bg, b=bb)
+            self.escapes[color_id] = seq
+            return seq
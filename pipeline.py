@@ -0,0 +1,201 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Transform pipelines for live charts. The steps from raw values to cell
+colors and labels are declared once per chart:
+
+    pipe = Pipeline([
+        ("clip", 0., 1e6),
+        ("log",),
+        ("aggregate", (20, 40), "mean"),
+        ("normalize", Norm(), (0., 14.)),
+        ("colorize", lut),
+        ("format", "%1.2f"),
+    ])
+    pipe(values)        # pipe.values, pipe.normed, pipe.levels, pipe.colors,
+                        # pipe.labels
+
+and compiled into NumPy operations on buffers allocated for the input
+shape on the first run. Later runs of the same shape write into the same
+buffers with out= arguments, thus a steady stream of ticks allocates no
+arrays, except for new labels: formatting a number makes a new string, so
+the format step allocates for the cells whose value changed.
+
+Steps:
+
+    ("clip", lo, hi)                values clipped to [lo, hi]
+    ("log",)                        natural log, non-positive values at -690
+    ("aggregate", cells, reduce)    values reduced into at most cells =
+                                    (rows, cols) blocks, reduce is "sum",
+                                    "mean" or "max", see raster.block_edges
+    ("normalize", norm, vrange)     values mapped into [0, 1] as normed, by a
+                                    normalize.Norm (Norm() if None) over vrange.
+                                    Without a fixed vrange it is found from
+                                    the values on each run, which allocates.
+    ("colorize", lut)               normed quantized into len(lut) levels,
+                                    and colors looked up in lut. lut may be a
+                                    number of levels, then only levels are set.
+    ("format", fmt, width)          labels of values, fmt % value cut at width.
+                                    Only cells whose value changed since the
+                                    last run are formatted again, a cell
+                                    staying nan does not count as changed.
+
+clip, log and aggregate transform values in order; normalize, colorize and
+format read the values as transformed by the steps before them.
+"""
+
+import numpy as np
+
+from normalize import Norm
+from raster import block_edges
+
+STEPS = ("clip", "log", "aggregate", "normalize", "colorize", "format")
+REDUCES = {"sum": np.add, "mean": np.add, "max": np.maximum}
+
+
+class Pipeline:
+
+    def __init__(self, steps):
+        for step in steps:
+            if step[0] not in STEPS:
+                raise ValueError("unknown step %r, steps are %s" % (step[0], ", ".join(STEPS)))
+        self.steps = [tuple(step) for step in steps]
+
+        self.shape = None
+        self.ops = []
+        self.input = None
+        self.values = self.normed = self.levels = self.colors = self.labels = None
+
+    def compile(self, shape):
+        """
+        allocate buffers of every step for input of given shape, and bind
+        the steps to them.
+        """
+        self.shape = tuple(shape)
+        self.input = self.values = np.empty(self.shape)
+        self.normed = self.levels = self.colors = self.labels = None
+        self.ops = [getattr(self, "compile_" + step[0])(*step[1:]) for step in self.steps]
+
+    def __call__(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.shape != self.shape:
+            self.compile(values.shape)
+        np.copyto(self.input, values)
+        for op in self.ops:
+            op()
+        return self
+
+    ### steps, each returns the operation of a run
+
+    def compile_clip(self, lo, hi):
+        values = self.values
+        return lambda: np.clip(values, lo, hi, out=values)
+
+    def compile_log(self):
+        values = self.values
+
+        def op():
+            np.maximum(values, 1e-300, out=values)
+            np.log(values, out=values)
+        return op
+
+    def compile_aggregate(self, cells, reduce="mean"):
+        if reduce not in REDUCES:
+            raise ValueError("reduce must be one of %s" % ", ".join(sorted(REDUCES)))
+        ufunc = REDUCES[reduce]
+
+        values = self.values
+        rows, cols = values.shape
+        row_edges = block_edges(rows, max(min(cells[0], rows), 1))
+        col_edges = block_edges(cols, max(min(cells[1], cols), 1))
+
+        partial = np.empty((len(row_edges) - 1, cols))
+        self.values = reduced = np.empty((len(row_edges) - 1, len(col_edges) - 1))
+        sizes = np.outer(np.diff(row_edges), np.diff(col_edges)).astype(float)
+
+        def op():
+            ufunc.reduceat(values, row_edges[:-1], axis=0, out=partial)
+            ufunc.reduceat(partial, col_edges[:-1], axis=1, out=reduced)
+            if reduce == "mean":
+                np.divide(reduced, sizes, out=reduced)
+        return op
+
+    def compile_normalize(self, norm=None, vrange=None):
+        norm = Norm() if norm is None else norm
+        values = self.values
+        self.normed = normed = np.empty(values.shape)
+        return lambda: norm(values, vrange, out=normed)
+
+    def compile_colorize(self, lut):
+        if self.normed is None:
+            raise ValueError("colorize needs a normalize step before it")
+        count = lut if isinstance(lut, int) else len(lut)
+
+        normed = self.normed
+        scaled = np.empty(normed.shape)
+        self.levels = levels = np.empty(normed.shape, dtype=int)
+        if not isinstance(lut, int):
+            lut = np.asarray(lut, dtype=object)
+            self.colors = np.empty(normed.shape, dtype=object)
+        colors = self.colors
+
+        def op():
+            np.multiply(normed, count - 1, out=scaled)
+            np.rint(scaled, out=scaled)
+            np.copyto(levels, scaled, casting='unsafe')
+            if colors is not None:
+                np.take(lut, levels, out=colors)
+        return op
+
+    def compile_format(self, fmt="%1.2f", width=24):
+        values = self.values
+        self.labels = labels = np.empty(values.shape, dtype='<U%d' % width)
+
+        # values labels were last formatted from, and cells never formatted
+        formatted = np.empty(values.shape)
+        unformatted = np.ones(values.shape, dtype=bool)
+        changed = np.empty(values.shape, dtype=bool)
+        is_nan = np.empty(values.shape, dtype=bool)
+        still_nan = np.empty(values.shape, dtype=bool)
+
+        def op():
+            # nan != nan, thus cells staying nan are masked out
+            np.not_equal(values, formatted, out=changed)
+            np.isnan(values, out=is_nan)
+            np.isnan(formatted, out=still_nan)
+            np.logical_and(is_nan, still_nan, out=still_nan)
+            np.greater(changed, still_nan, out=changed)     # changed and not still nan
+            np.logical_or(changed, unformatted, out=changed)
+
+            if changed.any():
+                # only the new labels are allocated
+                labels[changed] = np.char.mod(fmt, values[changed])
+                np.copyto(formatted, values)
+                unformatted.fill(False)
+        return op
+
+
+if __name__ == "__main__":
+
+    import time
+
+    from congram2 import scheme_colors
+
+    lut = scheme_colors("Sandy")
+    pipe = Pipeline([
+        ("clip", 0., 1e6),
+        ("log",),
+        ("aggregate", (50, 100), "mean"),
+        ("normalize", Norm(), (-2., 0.)),
+        ("colorize", lut),
+        ("format", "%1.2f"),
+    ])
+
+    frames = [np.random.random_sample((500, 1000)) for i in range(4)]
+    pipe(frames[0])
+    start = time.time()
+    for tick in range(100):
+        pipe(frames[tick % len(frames)])
+    print "%.2f ms per tick of %dx%d values into %dx%d cells" % (
+        (time.time() - start) * 10, frames[0].shape[0], frames[0].shape[1],
+        pipe.values.shape[0], pipe.values.shape[1])
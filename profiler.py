@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Opt-in render profiling. Time spent in each stage (build, composite, encode,
+write) and in rendering each node type is collected only while the profiler
+is enabled; when disabled an instrumented call costs one attribute check.
+
+    profiler.enable()
+    canvas.draw()
+    print profiler.format_report(profiler.last_report)
+"""
+
+import time
+import functools
+
+STAGES = ("build", "composite", "encode", "write")
+
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.last_report = None
+        self.reset()
+
+    def enable(self):
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        # stage -> [calls, seconds], node type -> [calls, seconds, strokes]
+        self.stages = dict((stage, [0, 0.]) for stage in STAGES)
+        self.nodes = {}
+        self.counters = {}
+
+        # time spent in nested stages, so that each stage reports its own
+        # time only.
+        self.stack = []
+        self.frame_start = time.time()
+
+    def enter(self):
+        self.stack.append(0.)
+
+    def leave(self, stage, elapsed):
+        nested = self.stack.pop()
+        entry = self.stages.setdefault(stage, [0, 0.])
+        entry[0] += 1
+        entry[1] += elapsed - nested
+        if self.stack:
+            self.stack[-1] += elapsed
+
+    def add_node(self, node_type, elapsed, strokes):
+        entry = self.nodes.setdefault(node_type, [0, 0., 0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += strokes
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def end_frame(self):
+        """
+        finish a frame: keep its report as last_report and start over.
+        """
+        if not self.enabled:
+            return None
+
+        self.last_report = {
+            'total':    time.time() - self.frame_start,
+            'stages':   dict((stage, {'calls': calls, 'time': secs})
+                             for stage, (calls, secs) in self.stages.items()),
+            'nodes':    dict((node, {'calls': calls, 'time': secs, 'strokes': strokes})
+                             for node, (calls, secs, strokes) in self.nodes.items()),
+            'counters': dict(self.counters)
+        }
+        self.reset()
+        return self.last_report
+
+    def format_report(self, report):
+
+        lines = ["frame %8.3f ms" % (report['total'] * 1e3)]
+        for stage in sorted(report['stages'], key=lambda s: -report['stages'][s]['time']):
+            entry = report['stages'][stage]
+            lines.append("  %-12s %8.3f ms %8d calls" % (stage, entry['time'] * 1e3, entry['calls']))
+        for node in sorted(report['nodes'], key=lambda n: -report['nodes'][n]['time']):
+            entry = report['nodes'][node]
+            lines.append("  %-12s %8.3f ms %8d nodes %8d strokes" % (
+                node, entry['time'] * 1e3, entry['calls'], entry['strokes']))
+        for name in sorted(report['counters']):
+            lines.append("  %-12s %8d" % (name, report['counters'][name]))
+        return "\n".join(lines)
+
+
+profiler = Profiler()
+
+
+def profiled(stage):
+    """
+    decorator counting calls and time of a function into given stage.
+    """
+    def decorate(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+
+            profiler.enter()
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.leave(stage, time.time() - start)
+
+        return wrapper
+    return decorate
@@ -0,0 +1,255 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Vectorized rasterization of numeric data into terminal glyphs. Functions here
+return plain unicode lines, and are shared by the Canvas API (congram.py) and
+the Rect tree (congram2.py).
+"""
+
+import numpy as np
+
+# a braille glyph is a 4x2 dot matrix, each dot is one bit of the code point
+# offset from U+2800, indexed by [dot_row][dot_col].
+BRAILLE_BASE = 0x2800
+BRAILLE_BITS = np.array([[0x01, 0x08],
+                         [0x02, 0x10],
+                         [0x04, 0x20],
+                         [0x40, 0x80]])
+BRAILLE_DOTS = (4, 2)
+
+# eighth blocks, indexed by how many eighths of the cell are filled
+BLOCKS = np.array([ord(c) for c in u" ▁▂▃▄▅▆▇█"])
+BLOCK_LEVELS = len(BLOCKS) - 1
+
+# half blocks for drawing two colors in one cell, by fore and back color.
+# vertical bars use the upper half, horizontal ones the left half.
+HALF_BLOCK = {True: u"▀", False: u"▌"}
+
+
+def to_unicode(codes):
+    """
+    convert a 2D array of code points into list of unicode lines.
+    """
+    codes = np.ascontiguousarray(codes, dtype='<u4')
+    return [line.tobytes().decode('utf-32-le') for line in codes]
+
+
+def minmax_decimate(data, bins):
+    """
+    把data分成bins段，每段保留最小和最大值，这样尖峰不会因为降采样而消失。
+    reduce data into bins, keeping min and max of each bin so that spikes
+    survive. Data shorter than bins is stretched. NaNs are ignored.
+    """
+    data = np.asarray(data, dtype=float).ravel()
+    if len(data) == 0:
+        raise ValueError("cannot decimate empty data")
+
+    if len(data) <= bins:
+        stretched = data[(np.arange(bins) * len(data)) // bins]
+        return stretched, stretched
+
+    edges = (np.arange(bins) * len(data)) // bins
+    return np.fmin.reduceat(data, edges), np.fmax.reduceat(data, edges)
+
+
+def value_range(lo, hi, vrange=None):
+    if vrange is not None:
+        return vrange
+    vmin, vmax = np.nanmin(lo), np.nanmax(hi)
+    return (vmin, vmax) if vmax > vmin else (vmin - 0.5, vmax + 0.5)
+
+
+def braille_lines(data, width, height, vrange=None):
+    """
+    rasterize data as a line of braille dots in width x height cells.
+    """
+    dot_rows = height * BRAILLE_DOTS[0]
+    dot_cols = width * BRAILLE_DOTS[1]
+
+    lo, hi = minmax_decimate(data, dot_cols)
+    vmin, vmax = value_range(lo, hi, vrange)
+    scale = (dot_rows - 1) / float(vmax - vmin)
+
+    # connect each column to its left neighbour so that steep slopes are
+    # drawn without gaps.
+    lo_conn, hi_conn = lo.copy(), hi.copy()
+    lo_conn[1:] = np.fmin(lo[1:], hi[:-1])
+    hi_conn[1:] = np.fmax(hi[1:], lo[:-1])
+
+    with np.errstate(invalid='ignore'):
+        lo_y = np.clip(np.round((lo_conn - vmin) * scale), 0, dot_rows - 1)
+        hi_y = np.clip(np.round((hi_conn - vmin) * scale), 0, dot_rows - 1)
+
+        # dot rows counted from bottom, then flipped so that top comes first.
+        # NaN bins compare False and stay blank.
+        ys = np.arange(dot_rows)[::-1, None]
+        dots = (ys >= lo_y[None, :]) & (ys <= hi_y[None, :])
+
+    dots = dots.reshape(height, BRAILLE_DOTS[0], width, BRAILLE_DOTS[1])
+    codes = (dots * BRAILLE_BITS[None, :, None, :]).sum(axis=(1, 3))
+    return to_unicode(codes + BRAILLE_BASE)
+
+
+def block_lines(data, width, height, vrange=None):
+    """
+    rasterize data as vertical bars of eighth blocks in width x height cells.
+    Each column shows the max of its bin.
+    """
+    _, hi = minmax_decimate(data, width)
+    vmin, vmax = value_range(hi, hi, vrange)
+    levels = height * BLOCK_LEVELS
+
+    # the minimum still gets the thinnest bar, NaN gets nothing.
+    with np.errstate(invalid='ignore'):
+        fill = 1 + np.round((hi - vmin) * (levels - 1) / float(vmax - vmin))
+        fill = np.where(np.isnan(fill), 0, np.clip(fill, 1, levels))
+
+    rows_from_bottom = np.arange(height)[::-1, None]
+    cell_fill = np.clip(fill[None, :] - rows_from_bottom * BLOCK_LEVELS,
+                        0, BLOCK_LEVELS).astype(int)
+    return to_unicode(BLOCKS[cell_fill])
+
+
+def bin2d(x, y, shape, xrange=None, yrange=None, weights=None):
+    """
+    count (or sum weights of) points falling into each cell of a rows x cols
+    grid. Row 0 is the top, i.e. the largest y. Points out of range or NaN
+    are dropped.
+    """
+    x = np.asarray(x, dtype=float).ravel()
+    y = np.asarray(y, dtype=float).ravel()
+    rows, cols = shape
+
+    xmin, xmax = value_range(x, x, xrange)
+    ymin, ymax = value_range(y, y, yrange)
+
+    # NaN compares False and is dropped along with out of range points
+    with np.errstate(invalid='ignore'):
+        valid = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+    if not valid.all():
+        x, y = x[valid], y[valid]
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float).ravel()[valid]
+
+    # points exactly on the far bound belong to the edge cell
+    ix = ((x - xmin) * (cols / float(xmax - xmin))).astype(np.intp)
+    iy = ((ymax - y) * (rows / float(ymax - ymin))).astype(np.intp)
+    np.minimum(ix, cols - 1, out=ix)
+    np.minimum(iy, rows - 1, out=iy)
+
+    cells = iy * cols + ix
+    counts = np.bincount(cells, weights, minlength=rows * cols)
+    return counts.reshape(rows, cols)
+
+
+def coo_arrays(matrix):
+    """
+    (row, col, data, shape) of a sparse matrix, given as a scipy.sparse matrix
+    (anything with tocoo()), a COO tuple (row, col, data, shape) or a CSR
+    dict with keys indptr, indices, data and shape.
+    """
+    if hasattr(matrix, "tocoo"):
+        coo = matrix.tocoo()
+        return coo.row, coo.col, coo.data, coo.shape
+
+    if isinstance(matrix, dict):
+        indptr = np.asarray(matrix["indptr"])
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return rows, np.asarray(matrix["indices"]), np.asarray(matrix["data"]), matrix["shape"]
+
+    row, col, data, shape = matrix
+    return np.asarray(row), np.asarray(col), np.asarray(data), shape
+
+
+def block_edges(length, cells):
+    """
+    first index of each of cells equal blocks of length, plus length
+    """
+    return (np.arange(cells + 1) * length) // cells
+
+
+def bin_sparse(row, col, data, shape, cells, reduce="sum"):
+    """
+    aggregate nonzeros of a sparse matrix into a grid of cells, each cell
+    covering a block of the matrix. Costs O(nonzeros + cells) whatever the
+    size of matrix.
+
+    reduce: "sum", "mean" (over the whole block, zeros included), "max"
+            (zeros included) or "count" of nonzeros.
+    """
+    rows, cols = min(cells[0], shape[0]), min(cells[1], shape[1])
+
+    # 与block_edges划分的块一致：第i块为[i*L//C, (i+1)*L//C)
+    # the blocks of block_edges: index r falls in block ((r+1)*C - 1) // L
+    ir = ((np.asarray(row, dtype=np.int64) + 1) * rows - 1) // shape[0]
+    ic = ((np.asarray(col, dtype=np.int64) + 1) * cols - 1) // shape[1]
+    index = ir * cols + ic
+    data = np.asarray(data, dtype=float)
+
+    if reduce == "count":
+        grid = np.bincount(index, minlength=rows * cols).astype(float)
+    elif reduce == "max":
+        grid = np.zeros(rows * cols)
+        np.maximum.at(grid, index, data)
+    elif reduce in ("sum", "mean"):
+        grid = np.bincount(index, data, minlength=rows * cols)
+    else:
+        raise ValueError("unknown reduce %r" % reduce)
+
+    grid = grid.reshape(rows, cols)
+    if reduce == "mean":
+        heights = np.diff(block_edges(shape[0], rows))
+        widths = np.diff(block_edges(shape[1], cols))
+        grid /= np.outer(heights, widths)
+    return grid
+
+
+def coarsen(values, factor):
+    """
+    mean over factor x factor blocks of a 2d array, partial blocks at the
+    edges included.
+    """
+    values = np.asarray(values, dtype=float)
+    if factor <= 1:
+        return values
+    rows = np.arange(0, values.shape[0], factor)
+    cols = np.arange(0, values.shape[1], factor)
+    sums = np.add.reduceat(np.add.reduceat(values, rows, axis=0), cols, axis=1)
+    heights = np.diff(np.append(rows, values.shape[0]))
+    widths = np.diff(np.append(cols, values.shape[1]))
+    return sums / np.outer(heights, widths)
+
+
+def gradient_cells(length):
+    """
+    sample [0, 1] at twice the resolution of length cells, returns values of
+    the first and the second half of each cell.
+    """
+    x = np.linspace(0., 1., 2 * length)
+    return x[0::2], x[1::2]
+
+
+line_raster = {
+    "braille": braille_lines,
+    "block"  : block_lines
+}
+
+
+if __name__ == "__main__":
+
+    # bin_sparse against blocks of the dense matrix
+    for shape, cells in [((10, 10), (4, 4)), ((37, 53), (12, 20)), ((7, 5), (9, 9))]:
+        dense = np.random.random_sample(shape) * (np.random.random_sample(shape) < 0.3)
+        row, col = np.nonzero(dense)
+        rows, cols = min(cells[0], shape[0]), min(cells[1], shape[1])
+        row_edges, col_edges = block_edges(shape[0], rows), block_edges(shape[1], cols)
+        blocks = [[dense[row_edges[i]:row_edges[i+1], col_edges[j]:col_edges[j+1]]
+                   for j in range(cols)] for i in range(rows)]
+        for reduce, func in [("sum", np.sum), ("mean", np.mean), ("max", np.max)]:
+            expected = np.array([[func(block) for block in line] for line in blocks])
+            binned = bin_sparse(row, col, dense[row, col], shape, cells, reduce)
+            assert np.allclose(binned, expected), (shape, cells, reduce)
+        ones = bin_sparse(*np.nonzero(np.ones(shape)), data=np.ones(shape[0] * shape[1]),
+                          shape=shape, cells=cells, reduce="mean")
+        assert np.allclose(ones, 1.), (shape, cells)
+    print "bin_sparse matches dense blocks"
@@ -0,0 +1,198 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Render core shared by the immediate-mode congram.Canvas and the congram2
+Rect tree. A front end hands its elements over line by line, anything with
+pos.col, text and a palette id as color will do:
+
+    lines: [(row, [(col, z, elem), ...])], each line sorted by col,
+           elements of larger z on top
+
+The core finds the visible parts of each line (composite), and a backend
+encodes and writes them, or puts them into a FrameBuffer:
+
+    render_lines(lines, TerminalBackend(palette, out))
+    render_lines(lines, FrameBufferBackend(fb, palette))
+
+A backend has two methods, line(row, parts) and flush(). Parts are
+(left, right, elem) from left to right, the visible columns [left, right)
+of elem.
+"""
+
+import sys
+import heapq
+
+from palette import COL_RESET
+from profiler import profiler, profiled
+from textwidth import text_width, col_slice
+
+
+@profiled("write")
+def write(text, out=None):
+    (out or sys.stdout).write(text)
+
+
+@profiled("composite")
+def visible_parts(elems_inline):
+    """
+    elems_inline: (col, z, elem) of a single line, sorted by column.
+    returns visible (left, right, elem) parts from left to right.
+    """
+
+    # Sweep from left to right. Elements covering current column are kept
+    # in a heap with the topmost (largest z) one at front, elements whose
+    # right bound has been passed are dropped lazily when they reach the
+    # front.
+
+    parts  = []
+    active = []
+    i      = 0
+    col    = elems_inline[0][0] if elems_inline else 0
+
+    while i < len(elems_inline) or active:
+
+        while i < len(elems_inline) and elems_inline[i][0] <= col:
+            left, z, elem = elems_inline[i]
+            heapq.heappush(active, (-z, left + text_width(elem.text), elem))
+            i += 1
+
+        while active and active[0][1] <= col:
+            heapq.heappop(active)
+
+        if not active:
+            if i == len(elems_inline):
+                break
+            col = elems_inline[i][0]
+            continue
+
+        # the topmost element stays visible until it ends or another
+        # element starts upon it.
+        _, right, elem = active[0]
+        if i < len(elems_inline):
+            right = min(right, elems_inline[i][0])
+
+        if parts and parts[-1][2] is elem and parts[-1][1] == col:
+            parts[-1] = (parts[-1][0], right, elem)
+        else:
+            parts.append((col, right, elem))
+        col = right
+
+    return parts
+
+
+def part_text(left, right, elem):
+    return col_slice(elem.text, left - elem.pos.col, right - elem.pos.col)
+
+
+@profiled("encode")
+def encode_line(parts, palette, is_reset=False):
+
+    strokes = []
+    curr_col = 0
+    curr_color = None
+
+    for left, right, elem in parts:
+        text = part_text(left, right, elem)
+
+        # 相邻且颜色相同的部分合并成一段，不再重复输出颜色
+        # adjacent parts of the same color are merged into a single run
+        if left == curr_col and elem.color == curr_color and not is_reset:
+            strokes.append(text)
+        else:
+            strokes.append(" " * (left - curr_col))
+            strokes.append(palette.escape(elem.color) + text)
+            strokes.append(COL_RESET if is_reset else "")
+        curr_col = right
+        curr_color = elem.color
+
+    return u"".join(strokes) + COL_RESET + "\n"
+
+
+class TerminalBackend:
+    """
+    writes each line, encoded with escapes of the palette, to out
+    (sys.stdout if None). Lines end with a newline.
+    """
+
+    def __init__(self, palette, out=None, is_reset=False):
+        self.palette = palette
+        self.out = out
+        self.is_reset = is_reset
+
+    def line(self, row, parts):
+        write(encode_line(parts, self.palette, self.is_reset), self.out)
+
+    def flush(self):
+        (self.out or sys.stdout).flush()
+
+
+class FrameBufferBackend:
+    """
+    puts visible parts into a FrameBuffer, with colors of the palette
+    """
+
+    def __init__(self, fb, palette):
+        self.fb = fb
+        self.palette = palette
+
+    def line(self, row, parts):
+        for left, right, elem in parts:
+            self.fb.put(row, left, part_text(left, right, elem),
+                        *self.palette.colors[elem.color])
+
+    def flush(self):
+        pass
+
+
+def render_lines(lines, backend):
+    """
+    composite lines, (row, elems_inline) in drawing order, and hand visible
+    parts to backend.
+    """
+    for row, elems_inline in lines:
+        parts = visible_parts(elems_inline)
+        profiler.count("parts", len(parts))
+        backend.line(row, parts)
+
+
+if __name__ == "__main__":
+
+    # the same heatmap drawn by both front ends through the core
+    import time
+    import numpy as np
+
+    import congram
+    import congram2
+
+    class NullOut:
+        def write(self, data):
+            pass
+        def flush(self):
+            pass
+
+    table = np.random.random_sample((16, 24))
+
+    def canvas():
+        c = congram.Canvas(cols=160)
+        c.add_heatmap(table.tolist(), congram.color_func["Sandy"])
+        return c
+
+    def tree():
+        c = congram2.Canvas(size=congram2.Pos(60, 160))
+        c.add_child(congram2.Heatmap(table=table.tolist(), grid_size=congram2.Pos(3, 6)))
+        return c
+
+    for name, build, draw in [("congram.Canvas", canvas, lambda c: c.render()),
+                              ("congram2.Rect", tree, lambda c: c.draw())]:
+        c = build()
+        c.out = NullOut()
+        draw(c)
+        start = time.time()
+        for i in range(20):
+            draw(c)
+        terminal = (time.time() - start) / 20
+        start = time.time()
+        for i in range(20):
+            c.frame_buffer()
+        buffered = (time.time() - start) / 20
+        print "%-16s terminal %6.1f ms   frame buffer %6.1f ms" % (name, terminal * 1000, buffered * 1000)
@@ -0,0 +1,180 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Axis scales. A scale maps data values onto a number of terminal cells, and
+gives the tick offsets together with their label strings. Ticks are cached
+per (range, length), so that redrawing the same frame costs nothing.
+"""
+
+import math
+
+from textwidth import text_width
+
+# 1, 2, 5 times power of 10 are considered as "nice" steps
+NICE_STEPS = (1, 2, 5, 10)
+
+# default number of cells between two ticks, along horizontal and vertical
+# axes. Cells are about twice as tall as wide.
+TICK_SPACING = 6
+VERT_TICK_SPACING = 3
+
+# the tick cache is dropped as a whole when it grows this large, e.g. when a
+# live range changes on every frame.
+MAX_CACHED = 4096
+
+
+def nice_step(span, max_ticks):
+    raw = span / float(max(max_ticks, 1))
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for step in NICE_STEPS:
+        if step * magnitude >= raw:
+            return step * magnitude
+
+
+def format_tick(val, step):
+    if val != 0 and not 1e-4 <= abs(val) < 1e6:
+        return "%.3g" % val
+    decimals = max(0, -int(math.floor(math.log10(step))))
+    return "%.*f" % (decimals, val)
+
+
+class Scale:
+
+    # tick cache shared by all scales, keyed by (scale key, length, spacing,
+    # vertical).
+    tick_cache = {}
+
+    def key(self):
+        raise NotImplementedError
+
+    def tick_values(self, length, spacing):
+        """
+        returns [(fraction, label)] where fraction is in [0, 1] along the axis
+        """
+        raise NotImplementedError
+
+    # numeric scales grow upward on vertical axes, while categories are
+    # listed from top to bottom.
+    flip_vertical = True
+
+    def to_offset(self, frac, length):
+        return int(round(frac * (length - 1)))
+
+    def ticks(self, length, spacing=TICK_SPACING, vertical=False):
+        """
+        returns [(offset, label)], where offset is the cell from the start
+        (left or top) of an axis with given length.
+        """
+        cache_key = (self.key(), length, spacing, vertical)
+        if cache_key not in Scale.tick_cache:
+            ticks = []
+            for frac, label in self.tick_values(length, spacing):
+                if vertical and self.flip_vertical:
+                    frac = 1 - frac
+                ticks.append((self.to_offset(frac, length), label))
+            if len(Scale.tick_cache) >= MAX_CACHED:
+                Scale.tick_cache.clear()
+            Scale.tick_cache[cache_key] = ticks
+        return Scale.tick_cache[cache_key]
+
+    def label_width(self, length, spacing=TICK_SPACING, vertical=False):
+        ticks = self.ticks(length, spacing, vertical)
+        return max(text_width(label) for _, label in ticks) if ticks else 0
+
+
+class LinearScale(Scale):
+
+    def __init__(self, vmin, vmax):
+        self.vmin = float(vmin)
+        self.vmax = float(vmax) if vmax > vmin else float(vmin) + 1
+
+    def key(self):
+        return ('linear', self.vmin, self.vmax)
+
+    def tick_values(self, length, spacing):
+        span = self.vmax - self.vmin
+        step = nice_step(span, length // spacing)
+        first = math.ceil(self.vmin / step) * step
+
+        ticks = []
+        val = first
+        while val <= self.vmax + step * 1e-9:
+            ticks.append(((val - self.vmin) / span, format_tick(val, step)))
+            val += step
+        return ticks
+
+
+class LogScale(Scale):
+
+    def __init__(self, vmin, vmax):
+        if vmin <= 0:
+            raise ValueError("log scale needs positive range")
+        self.vmin = float(vmin)
+        self.vmax = float(vmax) if vmax > vmin else float(vmin) * 10
+
+    def key(self):
+        return ('log', self.vmin, self.vmax)
+
+    def tick_values(self, length, spacing):
+        lo, hi = math.log10(self.vmin), math.log10(self.vmax)
+        decades = range(int(math.floor(lo)), int(math.ceil(hi)) + 1)
+
+        # add 2x and 5x ticks only if there's room for them
+        max_ticks = length // spacing
+        mults = (1, 2, 5) if len(decades) * 3 <= max_ticks else (1,)
+        every = max(1, int(math.ceil(len(decades) / float(max(max_ticks, 1)))))
+
+        ticks = []
+        for i, d in enumerate(decades):
+            if i % every != 0:
+                continue
+            for m in mults:
+                val = m * 10.0 ** d
+                if self.vmin <= val <= self.vmax:
+                    ticks.append(((math.log10(val) - lo) / (hi - lo), "%g" % val))
+        return ticks
+
+
+class CategoricalScale(Scale):
+
+    flip_vertical = False
+
+    # ticks sit at band centers, (i + 0.5) * length / n. The offset is
+    # found in integers from the band index, since frac * length may fall
+    # short of a whole cell.
+    def to_offset(self, frac, length):
+        n = len(self.labels)
+        i = int(round(frac * n - 0.5))
+        return (2 * i + 1) * length // (2 * n)
+
+    def __init__(self, labels):
+        self.labels = tuple(l if isinstance(l, basestring) else str(l)
+                            for l in labels)
+
+    def key(self):
+        return ('categorical', self.labels)
+
+    def tick_values(self, length, spacing):
+        n = len(self.labels)
+
+        # tick at the center of each band, skip some when bands are narrow
+        every = max(1, int(math.ceil(spacing * n / float(length))))
+        return [((i + 0.5) / n, label)
+                for i, label in enumerate(self.labels) if i % every == 0]
+
+
+def place_labels(ticks, width):
+    """
+    lay out tick labels of a horizontal axis in a single line of given width,
+    dropping those which would overlap their left neighbour.
+    returns [(col, label)]
+    """
+    placed = []
+    end = -1
+    for offset, label in ticks:
+        label_width = text_width(label)
+        col = min(max(offset - label_width // 2, 0), width - label_width)
+        if col > end:
+            placed.append((col, label))
+            end = col + label_width
+    return placed
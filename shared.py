@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Arrays shared with data producers running in other processes. A producer
+writes values straight into a memory mapped file, and a view reads them on
+each tick without any pickling. A generation counter tells the view whether
+anything changed since its last read.
+
+    # producer                              # renderer
+    arr = SharedArray.create("load", (8, 10))
+    with arr.updating():                    src = SharedSource(SharedArray.attach("load"))
+        arr.array[:] = values               heatmap = Heatmap(source=src)
+
+The counter works as a seqlock: it is odd while the producer is writing, so a
+reader retries until it sees the same even generation before and after
+copying the values.
+
+The file lives in /dev/shm where available, i.e. in memory.
+"""
+
+import os
+import mmap
+import time
+import struct
+import tempfile
+import contextlib
+
+import numpy as np
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+MAGIC = b"CGSA"
+MAX_DIMS = 4
+
+# magic, padding, generation, ndim, shape, dtype. The generation is 8 byte
+# aligned so that it is stored in one go.
+HEADER = struct.Struct('<4s4xQQ%dQ16s' % MAX_DIMS)
+GEN_OFFSET = 8
+DATA_OFFSET = 96
+
+
+def shared_path(name):
+    return os.path.join(SHM_DIR, "congram-" + name)
+
+
+class SharedArray:
+
+    def __init__(self, path, mapped):
+        self.path = path
+        self.mapped = mapped
+
+        fields = HEADER.unpack_from(mapped, 0)
+        magic, ndim = fields[0], fields[2]
+        if magic != MAGIC:
+            raise ValueError("%s is not a shared array" % path)
+        shape = fields[3:3+ndim]
+        dtype = np.dtype(fields[-1].rstrip(b"\0"))
+
+        self.gen = np.frombuffer(mapped, np.uint64, 1, GEN_OFFSET)
+        self.array = np.frombuffer(mapped, dtype, int(np.prod(shape)),
+                                   DATA_OFFSET).reshape(shape)
+
+    @classmethod
+    def create(cls, name, shape, dtype=np.float64):
+        """
+        create (or truncate) a shared array filled with zeros.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        if len(shape) > MAX_DIMS:
+            raise ValueError("at most %d dimensions are supported" % MAX_DIMS)
+
+        path = shared_path(name)
+        size = DATA_OFFSET + int(np.prod(shape)) * dtype.itemsize
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            mapped = mmap.mmap(f.fileno(), size)
+
+        padded = shape + (0,) * (MAX_DIMS - len(shape))
+        HEADER.pack_into(mapped, 0, MAGIC, 0, len(shape), *(padded + (dtype.str,)))
+        return cls(path, mapped)
+
+    @classmethod
+    def attach(cls, name):
+        path = shared_path(name)
+        with open(path, "r+b") as f:
+            mapped = mmap.mmap(f.fileno(), 0)
+        return cls(path, mapped)
+
+    @property
+    def generation(self):
+        return int(self.gen[0])
+
+    @contextlib.contextmanager
+    def updating(self):
+        """
+        write into self.array within this block, readers won't see a half
+        written array.
+        """
+        self.gen[0] += 1
+        try:
+            yield self.array
+        finally:
+            self.gen[0] += 1
+
+    def write(self, values):
+        with self.updating():
+            self.array[...] = values
+
+    def read(self, out=None, timeout=1.):
+        """
+        consistent copy of the values into out, returns (generation, out).
+        """
+        if out is None:
+            out = np.empty_like(self.array)
+
+        deadline = time.time() + timeout
+        while True:
+            before = self.generation
+            if before % 2 == 0:
+                np.copyto(out, self.array)
+                if self.generation == before:
+                    return before, out
+            if time.time() > deadline:
+                raise RuntimeError("shared array %s kept being written" % self.path)
+
+    def close(self):
+        self.array = self.gen = None
+        self.mapped.close()
+
+    def unlink(self):
+        os.remove(self.path)
+
+
+class SharedSource:
+    """
+    reading end of a SharedArray for a view. Values are copied into the same
+    buffer each time, and only when the producer has published new ones.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.buffer = np.empty_like(shared.array)
+        self.generation = None
+
+    def poll(self, force=False):
+        """
+        values if changed since last poll (or force), None otherwise.
+        """
+        if not force and self.shared.generation == self.generation:
+            return None
+        self.generation, values = self.shared.read(self.buffer)
+        return values
+
+
+if __name__ == "__main__":
+
+    import sys
+    import multiprocessing
+
+    from congram2 import Canvas, Frame, Heatmap
+
+    def produce(name, ticks):
+        arr = SharedArray.attach(name)
+        phase = np.linspace(0, np.pi, arr.array.size).reshape(arr.array.shape)
+        for tick in range(ticks):
+            arr.write(np.sin(phase + tick * 0.01) ** 2)
+            time.sleep(0.001)
+
+    arr = SharedArray.create("demo", (8, 10))
+    producer = multiprocessing.Process(target=produce, args=("demo", 3000))
+    producer.start()
+
+    heatmap = Heatmap(source=SharedSource(arr))
+    canvas = Canvas()
+    canvas.add_child(Frame(rect=heatmap, x_scale=heatmap.x_scale,
+                           y_scale=heatmap.y_scale))
+    while producer.is_alive():
+        sys.stdout.write('\x1b[H')
+        canvas.draw()
+        time.sleep(0.1)
+
+    producer.join()
+    arr.unlink()
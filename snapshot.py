@@ -0,0 +1,217 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Compact binary archive of rendered frames, and a replayer streaming them back
+to the terminal.
+
+Stream layout (little endian):
+
+    header:  MAGIC, version (B)
+    frame:   flags (B), payload length (I), payload (zlib'ed if FLAG_ZLIB)
+    payload: kind (B), timestamp (d), rows (H), cols (H),
+             number of new palette colors (H), r g b (3B) of each,
+             number of rows (H), then for each row:
+                 row index (H), number of runs (H), then for each run:
+                     fg (H), bg (H), utf-8 length (H), utf-8 text
+
+Palette indices refer to a palette shared by the whole stream, each frame
+only carries colors not seen before. A key frame has all rows, a delta frame
+only rows changed since the previous frame.
+"""
+
+import sys
+import time
+import zlib
+import struct
+
+import numpy as np
+
+from framebuffer import FrameBuffer
+from textwidth import char_width
+
+MAGIC = b"CGSN"
+VERSION = 1
+
+KEY_FRAME = 0
+DELTA_FRAME = 1
+FLAG_ZLIB = 1
+
+FRAME_HEAD = struct.Struct('<BI')
+PAYLOAD_HEAD = struct.Struct('<BdHH')
+COUNT = struct.Struct('<H')
+RGB = struct.Struct('<3B')
+ROW_HEAD = struct.Struct('<HH')
+RUN_HEAD = struct.Struct('<HHH')
+
+CURSOR_SEQ = '\x1b[{row};1H'
+
+
+class SnapshotWriter:
+
+    def __init__(self, stream, key_interval=100, compress=True):
+        """
+        stream:       a binary file-like object
+        key_interval: a key frame is written every key_interval frames
+        """
+        self.stream = stream
+        self.key_interval = key_interval
+        self.compress = compress
+
+        self.palette_index = {}
+        self.last = None
+        self.frame_count = 0
+        self.start = None
+
+        stream.write(MAGIC + struct.pack('<B', VERSION))
+
+    def stream_palette(self, fb):
+        """
+        map palette of a frame buffer into the stream palette, returns the
+        index mapping and newly added colors.
+        """
+        new_colors = []
+        mapping = np.zeros(len(fb.palette), dtype=np.uint16)
+        for i, rgb in enumerate(fb.palette):
+            if rgb not in self.palette_index:
+                self.palette_index[rgb] = len(self.palette_index)
+                new_colors.append(rgb)
+            mapping[i] = self.palette_index[rgb]
+        return mapping, new_colors
+
+    def write_frame(self, fb, timestamp=None):
+
+        if timestamp is None:
+            timestamp = time.time()
+        if self.start is None:
+            self.start = timestamp
+
+        is_key = self.frame_count % self.key_interval == 0 or self.last is None \
+                 or (self.last.rows, self.last.cols) != (fb.rows, fb.cols)
+        rows = range(fb.rows) if is_key else fb.changed_rows(self.last)
+        mapping, new_colors = self.stream_palette(fb)
+
+        payload = [PAYLOAD_HEAD.pack(KEY_FRAME if is_key else DELTA_FRAME,
+                                     timestamp - self.start, fb.rows, fb.cols),
+                   COUNT.pack(len(new_colors))]
+        payload.extend(RGB.pack(*rgb) for rgb in new_colors)
+        payload.append(COUNT.pack(len(rows)))
+
+        for row in rows:
+            runs = fb.row_runs(row)
+            payload.append(ROW_HEAD.pack(row, len(runs)))
+            for fore, back, text in runs:
+                text = text.encode('utf-8')
+                payload.append(RUN_HEAD.pack(mapping[fore], mapping[back], len(text)))
+                payload.append(text)
+
+        payload = b"".join(payload)
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload)
+            flags |= FLAG_ZLIB
+
+        self.stream.write(FRAME_HEAD.pack(flags, len(payload)) + payload)
+        self.last = fb
+        self.frame_count += 1
+
+
+class SnapshotReader:
+    """
+    iterate over (timestamp, frame buffer, changed rows) of a stream. Delta
+    frames are applied onto the previous frame.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+        head = stream.read(len(MAGIC) + 1)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a snapshot stream")
+        if struct.unpack('<B', head[len(MAGIC):])[0] != VERSION:
+            raise ValueError("unsupported snapshot version")
+
+        self.palette = []
+        self.frame = None
+
+    def __iter__(self):
+        while True:
+            head = self.stream.read(FRAME_HEAD.size)
+            if len(head) < FRAME_HEAD.size:
+                return
+            flags, length = FRAME_HEAD.unpack(head)
+            payload = self.stream.read(length)
+            if flags & FLAG_ZLIB:
+                payload = zlib.decompress(payload)
+            yield self.decode(payload)
+
+    def decode(self, payload):
+
+        kind, timestamp, rows, cols = PAYLOAD_HEAD.unpack_from(payload, 0)
+        offset = PAYLOAD_HEAD.size
+
+        (num_colors,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        for _ in range(num_colors):
+            self.palette.append(RGB.unpack_from(payload, offset))
+            offset += RGB.size
+
+        # every frame shares the stream palette
+        frame = FrameBuffer(rows, cols)
+        if kind == DELTA_FRAME and self.frame is not None:
+            frame.glyphs[:] = self.frame.glyphs
+            frame.fg[:] = self.frame.fg
+            frame.bg[:] = self.frame.bg
+        frame.palette = self.palette
+        frame.palette_index = None
+
+        (num_rows,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        changed = []
+        for _ in range(num_rows):
+            row, num_runs = ROW_HEAD.unpack_from(payload, offset)
+            offset += ROW_HEAD.size
+            col = 0
+            for _ in range(num_runs):
+                fore, back, length = RUN_HEAD.unpack_from(payload, offset)
+                offset += RUN_HEAD.size
+                text = payload[offset:offset+length].decode('utf-8')
+                offset += length
+
+                glyphs = expand_wide(text)
+                frame.glyphs[row, col:col+len(glyphs)] = glyphs
+                frame.fg[row, col:col+len(glyphs)] = fore
+                frame.bg[row, col:col+len(glyphs)] = back
+                col += len(glyphs)
+            changed.append(row)
+
+        self.frame = frame
+        return timestamp, frame, changed
+
+
+def expand_wide(text):
+    """
+    glyphs of a run, with an empty glyph after each wide character as in
+    FrameBuffer.
+    """
+    glyphs = []
+    for ch in text:
+        glyphs.append(ch)
+        if char_width(ch) == 2:
+            glyphs.append(u"")
+    return glyphs
+
+
+def replay(stream, out=sys.stdout, speed=1.0):
+    """
+    stream frames back to terminal, at original speed or speed times faster.
+    Only changed rows are redrawn.
+    """
+    start = time.time()
+    for timestamp, frame, changed in SnapshotReader(stream):
+        delay = timestamp / speed - (time.time() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+        for row in changed:
+            out.write(CURSOR_SEQ.format(row=row + 1) + frame.encode_row(row))
+        out.flush()
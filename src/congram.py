@@ -24,7 +24,7 @@ class Pos:
     def __mul__(self, pos_time):
         if type(pos_time) is tuple:
             return Pos(self.row * pos_time[0], self.col * pos_time[1])
-        return Pos(self.row * pos_time.row, self.col * pos_time.row)
+        return Pos(self.row * pos_time.row, self.col * pos_time.col)
 
     def __str__(self):
         return "{%d, %d}" % (self.row, self.col)
@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Display width of strings in terminal columns. CJK and other wide characters
+take two columns, combining marks take none. Widths are cached per distinct
+string, so that labels drawn every frame are measured once.
+"""
+
+import unicodedata
+
+# cache is dropped as a whole when it grows too large, e.g. when live data
+# keeps producing new labels.
+MAX_CACHED = 65536
+width_cache = {}
+
+
+def char_width(ch):
+    if unicodedata.combining(ch):
+        return 0
+    if unicodedata.east_asian_width(ch) in ('W', 'F'):
+        return 2
+    return 1
+
+
+def text_width(text):
+
+    # byte strings in this project are plain ascii
+    if isinstance(text, str):
+        return len(text)
+
+    try:
+        return width_cache[text]
+    except KeyError:
+        pass
+
+    width = sum(char_width(ch) for ch in text)
+    if len(width_cache) >= MAX_CACHED:
+        width_cache.clear()
+    width_cache[text] = width
+    return width
+
+
+def col_slice(text, start, end):
+    """
+    part of text displayed in columns [start, end). A wide character cut by
+    either bound is replaced by spaces, so that the result is always exactly
+    end - start columns wide.
+    """
+    if text_width(text) == len(text):
+        return text[start:end]
+
+    result = []
+    col = 0
+    for ch in text:
+        width = char_width(ch)
+        if col >= end:
+            break
+        if col >= start and col + width <= end:
+            result.append(ch)
+        elif col + width > start:
+            # partially visible wide character
+            result.append(u" " * (min(col + width, end) - max(col, start)))
+        col += width
+    return u"".join(result)
+
+
+# padding by display width, plain ascii strings keep str's own behaviour
+
+def rjust(text, width):
+    if isinstance(text, str):
+        return text.rjust(width)
+    return u" " * (width - text_width(text)) + text
+
+
+def ljust(text, width):
+    if isinstance(text, str):
+        return text.ljust(width)
+    return text + u" " * (width - text_width(text))
+
+
+def center(text, width):
+    if isinstance(text, str):
+        return text.center(width)
+    padding = width - text_width(text)
+    if padding <= 0:
+        return text
+    left = padding // 2
+    return u" " * left + text + u" " * (padding - left)
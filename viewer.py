@@ -0,0 +1,226 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Interactive viewer for large matrices. It takes over the alternate screen,
+and keys pan and zoom over a pyramid of the matrix:
+
+    arrows / hjkl   pan
+    + / -           zoom in / out
+    m               switch between mean and max of aggregated cells
+    q               quit
+
+Every zoom level is aggregated once when the viewer starts, and each redraw
+only sends rows which differ from the previous frame.
+"""
+
+import os
+import sys
+import tty
+import termios
+
+import numpy as np
+
+from congram import Canvas, Rect, Pos, CharColor, color_func, get_term_size, \
+                    level_color, ranged_levels
+
+ALT_SCREEN_ON = '\x1b[?1049h\x1b[?25l'
+ALT_SCREEN_OFF = '\x1b[?25h\x1b[?1049l'
+CURSOR_SEQ = '\x1b[{row};1H'
+
+KEYS = {
+    '\x1b[A': 'up',    'k': 'up',
+    '\x1b[B': 'down',  'j': 'down',
+    '\x1b[C': 'right', 'l': 'right',
+    '\x1b[D': 'left',  'h': 'left',
+    '+': 'zoom_in',    '=': 'zoom_in',
+    '-': 'zoom_out',
+    'm': 'mode',
+    'q': 'quit',
+}
+
+
+def block_reduce(data, ufunc, fill):
+    """
+    reduce 2x2 blocks of a matrix with ufunc, odd sizes are padded with fill
+    """
+    rows, cols = data.shape
+    padded = np.full(((rows + 1) // 2 * 2, (cols + 1) // 2 * 2), fill)
+    padded[:rows, :cols] = data
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    return ufunc.reduce(ufunc.reduce(blocks, axis=3), axis=1)
+
+
+class Pyramid:
+    """
+    mean and max of a matrix at power-of-two scales: level k aggregates
+    2**k x 2**k blocks of the data, down to a single cell.
+    """
+
+    def __init__(self, data):
+
+        data = np.asarray(data, dtype=float)
+
+        # 均值由逐级累加的和与个数算出，不受边缘不满的块影响
+        # means come from sums and counts, thus exact for partial blocks at
+        # the edges too.
+        sums, counts, maxes = [data], [np.ones(data.shape)], [data]
+        while max(sums[-1].shape) > 1:
+            sums.append(block_reduce(sums[-1], np.add, 0.))
+            counts.append(block_reduce(counts[-1], np.add, 0.))
+            maxes.append(block_reduce(maxes[-1], np.maximum, -np.inf))
+
+        self.levels = {
+            'mean': [s / c for s, c in zip(sums, counts)],
+            'max':  maxes
+        }
+        self.ranges = dict((mode, [(level.min(), level.max()) for level in levels])
+                           for mode, levels in self.levels.items())
+
+    def __len__(self):
+        return len(self.levels['mean'])
+
+    def window(self, mode, level, top, left, rows, cols):
+        return self.levels[mode][level][top:top+rows, left:left+cols]
+
+
+class Viewer:
+
+    def __init__(self, data, color_scheme=color_func["Sandy"], cell_width=2,
+                 out=sys.stdout):
+
+        self.pyramid = Pyramid(data)
+        self.color_func = color_scheme
+        self.cell_width = cell_width
+        self.out = out
+
+        rows, cols = get_term_size()
+        self.cols = cols
+
+        # the last line shows the status
+        self.view = Pos(rows - 1, cols // cell_width)
+
+        # start from the finest level showing the whole matrix
+        self.mode = 'mean'
+        self.level = 0
+        while self.level < len(self.pyramid) - 1 and not self.fits(self.level):
+            self.level += 1
+        self.top, self.left = 0, 0
+
+        self.cell_colors = {}
+        self.last = None
+
+    def fits(self, level):
+        rows, cols = self.pyramid.levels['mean'][level].shape
+        return rows <= self.view.row and cols <= self.view.col
+
+    def clamp(self):
+        rows, cols = self.pyramid.levels[self.mode][self.level].shape
+        self.top = max(0, min(self.top, rows - self.view.row))
+        self.left = max(0, min(self.left, cols - self.view.col))
+
+    def zoom(self, step):
+        """
+        step -1 zooms in, 1 out, keeping the center of view in place
+        """
+        level = self.level + step
+        if not 0 <= level < len(self.pyramid):
+            return
+
+        scale = 2. ** -step
+        center_row = (self.top + self.view.row / 2.) * scale
+        center_col = (self.left + self.view.col / 2.) * scale
+        self.level = level
+        self.top = int(center_row - self.view.row / 2.)
+        self.left = int(center_col - self.view.col / 2.)
+        self.clamp()
+
+    def handle(self, key):
+        """
+        returns False when the viewer should quit
+        """
+        action = KEYS.get(key)
+        pan = Pos(max(self.view.row // 4, 1), max(self.view.col // 4, 1))
+
+        if action == 'quit':
+            return False
+        elif action == 'up':
+            self.top -= pan.row
+        elif action == 'down':
+            self.top += pan.row
+        elif action == 'left':
+            self.left -= pan.col
+        elif action == 'right':
+            self.left += pan.col
+        elif action == 'zoom_in':
+            self.zoom(-1)
+        elif action == 'zoom_out':
+            self.zoom(1)
+        elif action == 'mode':
+            self.mode = 'max' if self.mode == 'mean' else 'mean'
+        self.clamp()
+        return True
+
+    def cell_color(self, level):
+        if level not in self.cell_colors:
+            color = level_color(self.color_func, level)
+            self.cell_colors[level] = CharColor(color, color)
+        return self.cell_colors[level]
+
+    def frame(self):
+        """
+        FrameBuffer of current view, rendered from the cached level
+        """
+        canvas = Canvas(self.cols)
+        window = self.pyramid.window(self.mode, self.level, self.top, self.left,
+                                     self.view.row, self.view.col)
+        lo, hi = self.pyramid.ranges[self.mode][self.level]
+        levels = ranged_levels(window, lo, hi)
+        changes = levels[:, 1:] != levels[:, :-1]
+
+        # 每行颜色相同的相邻格子合成一个元素
+        # one element per run of cells of the same color
+        for row in range(window.shape[0]):
+            bounds = [0] + (np.flatnonzero(changes[row]) + 1).tolist() + [window.shape[1]]
+            for left, right in zip(bounds[:-1], bounds[1:]):
+                canvas.add_elem(Rect(Pos(row, left * self.cell_width),
+                                     self.cell_color(int(levels[row, left])),
+                                     " " * ((right - left) * self.cell_width)))
+
+        rows, cols = self.pyramid.levels[self.mode][self.level].shape
+        status = " %s  1:%d  rows %d-%d/%d  cols %d-%d/%d  [%.3g, %.3g]" % (
+            self.mode, 2 ** self.level,
+            self.top, self.top + window.shape[0], rows,
+            self.left, self.left + window.shape[1], cols, lo, hi)
+        canvas.add_elem(Rect(Pos(self.view.row, 0), CharColor((0, 0, 0), (200, 200, 200)),
+                             status[:self.cols].ljust(self.cols)))
+        return canvas.frame_buffer()
+
+    def draw(self):
+        fb = self.frame()
+        for row in fb.changed_rows(self.last):
+            self.out.write(CURSOR_SEQ.format(row=row + 1))
+            self.out.write(fb.encode_row(row).encode('utf-8'))
+        self.out.flush()
+        self.last = fb
+
+    def run(self):
+
+        fd = sys.stdin.fileno()
+        saved = termios.tcgetattr(fd)
+        self.out.write(ALT_SCREEN_ON)
+        try:
+            tty.setraw(fd)
+            self.draw()
+            while self.handle(os.read(fd, 8)):
+                self.draw()
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+            self.out.write(ALT_SCREEN_OFF)
+            self.out.flush()
+
+
+if __name__ == "__main__":
+
+    rows, cols = np.mgrid[0:2000, 0:3000]
+    data = np.sin(rows / 97.) * np.cos(cols / 53.) + np.random.random_sample(rows.shape) * 0.3
+    Viewer(data).run()
@@ -0,0 +1,173 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Scrolling waterfall (spectrogram) heatmap. Each pushed vector becomes a row
+of colored cells at the bottom of a scroll region, and the terminal scrolls
+older rows up by itself (DECSTBM plus SU), so a tick sends exactly one row
+however long the history is.
+
+    fall = Waterfall(width=80, height=20)
+    fall.setup()
+    for spectrum in stream:
+        fall.push(spectrum)
+    fall.close()
+
+The last height rows are kept in a ring buffer for redrawing the whole
+region, e.g. after the screen was cleared.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from congram import CharColor, color_func, level_color, COLOR_LEVELS
+from normalize import Norm
+from palette import Palette, COL_RESET
+from raster import block_edges
+
+REGION_SEQ = '\x1b[{top};{bottom}r'
+RESET_REGION = '\x1b[r'
+CURSOR_SEQ = '\x1b[{row};{col}H'
+SCROLL_UP = '\x1b[S'
+
+
+def resample(vector, width):
+    """
+    vector averaged (or stretched) into width bins
+    """
+    vector = np.asarray(vector, dtype=float).ravel()
+    if len(vector) <= width:
+        return vector[(np.arange(width) * len(vector)) // width]
+    edges = block_edges(len(vector), width)
+    return np.add.reduceat(vector, edges[:-1]) / np.diff(edges)
+
+
+class Waterfall:
+
+    def __init__(self, width=80, height=20, top=1, left=1,
+                 color_scheme=color_func["Sandy"],
+                 vrange=None,
+                 norm=None,
+                 label_width=0,
+                 out=sys.stdout):
+        """
+        width, height: cells of the region, vectors are resampled to width
+        top, left:     screen position of the region, counted from 1
+        vrange:        fixed (lo, hi) of colors. If None, the range follows
+                       quantiles of everything pushed so far, kept in a
+                       norm.sketch(); rows already shown keep their colors.
+        norm:          normalize.Norm, 1-99 percentiles by default
+        label_width:   room for a label (e.g. time) left of each row
+        """
+        self.width = width
+        self.height = height
+        self.top = top
+        self.left = left
+        self.color_func = color_scheme
+        self.vrange = vrange
+        self.norm = Norm(clip=(1, 99)) if norm is None else norm
+        self.sketch = self.norm.sketch()
+        self.label_width = label_width
+        self.out = out
+
+        # ring buffer of shown rows, head is where the next row goes
+        self.rows = np.zeros((height, width))
+        self.labels = [""] * height
+        self.head = 0
+        self.count = 0
+
+        self.palette = Palette()
+        self.level_ids = {}
+
+    def setup(self):
+        """
+        clear the region and confine scrolling to it
+        """
+        bottom = self.top + self.height - 1
+        self.out.write(REGION_SEQ.format(top=self.top, bottom=bottom))
+        for row in range(self.top, bottom + 1):
+            self.out.write(CURSOR_SEQ.format(row=row, col=self.left))
+            self.out.write(" " * (self.label_width + self.width))
+        self.out.flush()
+
+    def close(self):
+        self.out.write(RESET_REGION + CURSOR_SEQ.format(row=self.top + self.height, col=1))
+        self.out.flush()
+
+    def color_id(self, level):
+        if level not in self.level_ids:
+            color = level_color(self.color_func, level)
+            self.level_ids[level] = self.palette.intern(CharColor(color, color))
+        return self.level_ids[level]
+
+    def encode_row(self, values, label):
+        """
+        escape sequences of a row, one color change per run of equal levels
+        """
+        vrange = self.vrange
+        if vrange is None:
+            vrange = self.norm.sketch_range(self.sketch)
+        levels = np.rint(self.norm(values, vrange) * (COLOR_LEVELS-1)).astype(int)
+
+        change = np.flatnonzero(levels[1:] != levels[:-1]) + 1
+        bounds = [0] + change.tolist() + [len(levels)]
+        parts = [label[:self.label_width].rjust(self.label_width)] if self.label_width else []
+        for l, r in zip(bounds[:-1], bounds[1:]):
+            parts.append(self.palette.escape(self.color_id(int(levels[l]))) + " " * (r - l))
+        return "".join(parts) + COL_RESET
+
+    def push(self, vector, label=""):
+        """
+        add a row at the bottom, scrolling the region up by one row
+        """
+        values = resample(vector, self.width)
+        if self.vrange is None:
+            self.sketch.update(values)
+
+        self.rows[self.head] = values
+        self.labels[self.head] = label
+        self.head = (self.head + 1) % self.height
+        self.count = min(self.count + 1, self.height)
+
+        bottom = self.top + self.height - 1
+        self.out.write(CURSOR_SEQ.format(row=bottom, col=1) + SCROLL_UP +
+                       CURSOR_SEQ.format(row=bottom, col=self.left) +
+                       self.encode_row(values, label))
+        self.out.flush()
+
+    def history(self):
+        """
+        shown rows from the oldest to the newest, with their labels
+        """
+        order = [(self.head - self.count + i) % self.height for i in range(self.count)]
+        return self.rows[order], [self.labels[i] for i in order]
+
+    def redraw(self):
+        """
+        repaint the whole region from the ring buffer
+        """
+        self.setup()
+        rows, labels = self.history()
+        first = self.top + self.height - len(rows)
+        for i, (values, label) in enumerate(zip(rows, labels)):
+            self.out.write(CURSOR_SEQ.format(row=first + i, col=self.left) +
+                           self.encode_row(values, label))
+        self.out.flush()
+
+
+if __name__ == "__main__":
+
+    sys.stdout.write('\x1b[2J')
+    fall = Waterfall(width=100, height=30, top=2, label_width=8)
+    fall.setup()
+    freqs = np.linspace(0, 1, 512)
+    start = time.time()
+    try:
+        for tick in range(300):
+            peak = 0.5 + 0.4 * np.sin(tick / 20.)
+            spectrum = np.exp(-((freqs - peak) / 0.03) ** 2) + np.random.random_sample(512) * 0.2
+            fall.push(spectrum, "%.1fs" % (time.time() - start))
+            time.sleep(0.02)
+    finally:
+        fall.close()